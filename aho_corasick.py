@@ -0,0 +1,61 @@
+from collections import deque
+
+class AhoCorasick:
+    """Automaton that finds every occurrence of many fixed strings in one pass over a text.
+
+    Patterns are (string, value) pairs; several patterns may share a value and
+    one string may carry several values. Build once, then call iter_matches for
+    each text.
+    """
+    __slots__ = ("_goto", "_fail", "_out")
+
+    def __init__(self, patterns=()):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+
+        for pattern, value in patterns:
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = next_state
+            self._out[state].append((len(pattern), value))
+
+        # Breadth-first pass sets failure links and merges outputs along them
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._out[next_state].extend(self._out[self._fail[next_state]])
+
+    def iter_matches(self, text, whole_words=False):
+        """Yield (start, end, value) for every pattern occurrence in text.
+
+        With whole_words=True, matches that start or end inside a word are skipped.
+        """
+        goto = self._goto
+        fail = self._fail
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, value in self._out[state]:
+                start, end = i - length + 1, i + 1
+                if whole_words and ((start > 0 and text[start - 1].isalnum()) or
+                                    (end < len(text) and text[end].isalnum())):
+                    continue
+                yield start, end, value
@@ -3,8 +3,9 @@ import logging
 import json
 import random
 import requests
-from config import MISTRAL_API_KEY
-from rag_engine import generate_context_for_query
+from config import MISTRAL_API_KEY, CURATED_TOPICS
+from rag_engine import generate_context_for_query, find_dose_rows, dose_rows_answer_query
+from query_analysis import analyze_query
 
 logger = logging.getLogger(__name__)
 
@@ -84,44 +85,50 @@ def generate_ai_response(messages, temperature=0.7, max_tokens=1000):
         # Return a fallback message instead of None
         return "Unexpected error with AI service. Please try again later."
 
+def format_dose_answer(dose_rows):
+    """Format dose rows from the guideline tables as a direct answer."""
+    lines = ["From the dosage tables of the Standard Treatment Guidelines:"]
+    lines.extend(f"- {row.format()}" for row in dose_rows)
+    return "\n".join(lines)
+
 def get_diagnosis_response(user_query):
     """Get an AI diagnosis response based on the user query."""
-    # Generate context from document
-    context = generate_context_for_query(user_query)
+    # Analyze the query once and share the result with retrieval
+    analysis = analyze_query(user_query)
     
     # Check if it's a treatment or diagnosis query to customize prompt
-    query_lower = user_query.lower()
+    is_treatment_query = analysis.is_treatment_query
+    is_diagnosis_query = analysis.is_diagnosis_query
     
-    # Check for treatment-related queries
-    treatment_phrases = ['treatment for', 'treatment of', 'how to treat', 'medicine for', 
-                        'drug for', 'therapy for', 'exact treatment', 'management of']
+    # Exact rows from the guide's dosage tables for the drugs and conditions mentioned
+    dose_rows, dose_drugs = find_dose_rows(user_query, analysis)
     
-    # Check for diagnosis-related queries
-    diagnosis_phrases = ['diagnosis of', 'symptoms of', 'signs of', 'diagnosing', 
-                        'diagnostic criteria', 'what is', 'what diagnosis']
+    # A pure dose lookup for a drug in the tables needs no retrieval or model round-trip, as long as the
+    # rows are for the condition and patient group asked about; otherwise they only go into the prompt
+    if analysis.is_dose_query and dose_drugs and dose_rows_answer_query(dose_rows, user_query, analysis):
+        logger.info(f"Answered dose query from {len(dose_rows)} dosage table rows")
+        return format_dose_answer(dose_rows)
     
-    is_treatment_query = any(phrase in query_lower for phrase in treatment_phrases)
-    is_diagnosis_query = any(phrase in query_lower for phrase in diagnosis_phrases)
+    # Generate context from document
+    context = generate_context_for_query(user_query, analysis=analysis)
     
     # Add special handling for potentially confused conditions
-    contains_large_chronic_ulcers = 'large chronic ulcers' in query_lower or 'chronic skin ulcers' in query_lower
-    contains_peptic_ulcer = 'peptic ulcer' in query_lower
+    contains_large_chronic_ulcers = analysis.contains_large_chronic_ulcers
+    contains_peptic_ulcer = analysis.contains_peptic_ulcer
     
     # Check for potential confusion between similar conditions
     requires_disambiguation = False
     
     # If both conditions are mentioned, no need for disambiguation as the query likely already specifies
-    if not (contains_large_chronic_ulcers and contains_peptic_ulcer):
-        # Check for "ulcer" by itself which might cause confusion
-        if 'ulcer' in query_lower:
-            if contains_large_chronic_ulcers:
-                # Explicitly note this is about skin ulcers
-                user_query = user_query.replace("Large Chronic Ulcers", "Large Chronic Skin Ulcers (a dermatological condition)") 
-                requires_disambiguation = True
-            elif contains_peptic_ulcer:
-                # Explicitly note this is about gastrointestinal ulcers
-                user_query = user_query.replace("Peptic Ulcer Disease", "Peptic Ulcer Disease (a gastrointestinal condition)")
-                requires_disambiguation = True
+    if analysis.needs_ulcer_disambiguation:
+        if contains_large_chronic_ulcers:
+            # Explicitly note this is about skin ulcers
+            user_query = user_query.replace("Large Chronic Ulcers", "Large Chronic Skin Ulcers (a dermatological condition)") 
+            requires_disambiguation = True
+        elif contains_peptic_ulcer:
+            # Explicitly note this is about gastrointestinal ulcers
+            user_query = user_query.replace("Peptic Ulcer Disease", "Peptic Ulcer Disease (a gastrointestinal condition)")
+            requires_disambiguation = True
     
     # Base system prompt - then customize based on query type
     system_content = f"""You are a precise medical assistant that references the Standard Treatment Guidelines.
@@ -137,6 +144,14 @@ def get_diagnosis_response(user_query):
     5. If the reference doesn't contain relevant information, simply state "The guidelines do not contain specific information about this query."
     """
     
+    # Table rows are exact, so doses are quoted from them rather than paraphrased from the text
+    if dose_rows and (is_treatment_query or analysis.is_dose_query or dose_drugs):
+        dose_lines = "\n".join(f"- {row.format()}" for row in dose_rows)
+        system_content += f"""
+    DOSAGE TABLE ROWS from the guidelines (quote doses, frequencies and durations exactly as given):
+    {dose_lines}
+    """
+    
     # Add specific instructions for treatment queries
     if is_treatment_query:
         system_content += """
@@ -200,34 +215,12 @@ def get_diagnosis_response(user_query):
 def generate_case_simulation():
     """Generate a simulated patient case with sequential questions."""
     # Get a random topic from the curated list
-    curated_topics = [
-        "Diarrhoea", "Rotavirus Disease and Diarrhoea", "Constipation", "Peptic Ulcer Disease",
-        "Gastro-oesophageal Reflux Disease", "Haemorrhoids", "Vomiting", "Anaemia", "Measles",
-        "Pertussis", "Common cold", "Pneumonia", "Headache", "Boils", "Impetigo", "Buruli ulcer",
-        "Yaws", "Superficial Fungal Skin infections", "Pityriasis Versicolor", "Herpes Simplex Infections",
-        "Herpes Zoster Infections", "Chicken pox", "Large Chronic Ulcers", "Pruritus", "Urticaria",
-        "Reactive Erythema and Bullous Reaction", "Acne Vulgaris", "Eczema", "Intertrigo", "Diabetes Mellitus",
-        "Diabetic Ketoacidosis", "Diabetes in Pregnancy", "Treatment-Induced Hypoglycemia", "Dyslipidaemia",
-        "Goitre", "Hypothyroidism", "Hyperthyroidism", "Overweight and Obesity", "Dysmenorrhoea",
-        "Abortion", "Abnormal Vaginal Bleeding", "Abnormal Vaginal Discharge", "Acute Lower Abdominal Pain",
-        "Menopause", "Erectile Dysfunction", "Urinary Tract Infection", "Sexually Transmitted Infections in Adults",
-        "Fever", "Tuberculosis", "Typhoid fever", "Malaria", "Uncomplicated Malaria", "Severe Malaria",
-        "Malaria in Pregnancy", "Worm Infestation", "Xerophthalmia", "Foreign body in the eye",
-        "Neonatal conjunctivitis", "Red eye", "Stridor", "Acute Epiglottitis", "Retropharyngeal Abscess",
-        "Pharyngitis and Tonsillitis", "Acute Sinusitis", "Acute otitis Media", "Chronic Otitis Media",
-        "Epistaxis", "Dental Caries", "Oral Candidiasis", "Acute Necrotizing Ulcerative Gingivitis",
-        "Acute Bacterial Sialoadenitis", "Chronic Periodontal Infections", "Mouth Ulcers", "Odontogenic Infections",
-        "Osteoarthritis", "Rheumatoid arthritis", "Juvenile Idiopathic Arthritis", "Back pain", "Gout",
-        "Dislocations", "Open Fractures", "Cellulitis", "Burns", "Wounds", "Bites and Stings",
-        "Shock", "Acute Allergic Reaction"
-    ]
-    selected_topic = random.choice(curated_topics)
+    selected_topic = random.choice(CURATED_TOPICS)
     logger.info(f"Selected topic for case simulation: {selected_topic}")
     
-    # Get relevant document content for the selected topic
-    from document_processor import search_document
-    from rag_engine import generate_context_for_query
-    topic_info = generate_context_for_query(selected_topic)
+    # Get the precomputed guide context for the selected topic
+    from rag_engine import get_topic_context
+    topic_info = get_topic_context(selected_topic) or generate_context_for_query(selected_topic)
     
     # Create a medical case based on the selected topic
     case_data = create_medical_case_from_topic(selected_topic, topic_info)
@@ -1018,6 +1011,14 @@ def generate_flashcards(topic):
     """Generate flashcards for a specific medical topic."""
     # First try to generate flashcards using the AI
     try:
+        # Curated topics come with precomputed guide context, no retrieval needed
+        from rag_engine import get_topic_context
+        topic_info = get_topic_context(topic)
+        guideline_note = f"""
+            Base the flashcards on these guideline excerpts:
+            {topic_info}
+            """ if topic_info else ""
+        
         messages = [
             {"role": "system", "content": f"""Create a set of 5 flashcards for studying {topic} in medicine.
             Each flashcard should have a question on one side and a concise, clear answer on the other.
@@ -1025,7 +1026,7 @@ def generate_flashcards(topic):
             - question: the front side of the flashcard
             - answer: the back side with the correct information
             - difficulty: a rating from 1-3 (1=easy, 2=medium, 3=hard)
-            """},
+            {guideline_note}"""},
             {"role": "user", "content": f"Generate 5 medical flashcards about {topic}."}
         ]
         
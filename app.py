@@ -62,13 +62,15 @@ def initialize_document_and_rag():
     with app.app_context():
         try:
             from document_processor import initialize_document_processor
-            from rag_engine import initialize_rag_engine
+            from rag_engine import initialize_rag_engine, start_document_watcher
             
             doc_init_success = initialize_document_processor()
             if doc_init_success:
                 rag_init_success = initialize_rag_engine()
                 if rag_init_success:
                     logger.info("Document processor and RAG engine initialized successfully")
+                    # Pick up new revisions of the guidelines document without a restart
+                    start_document_watcher()
                     return True
                 else:
                     logger.warning("RAG engine initialization failed, some features may be limited")
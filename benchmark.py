@@ -0,0 +1,345 @@
+"""
+MediQA Retrieval Benchmark
+This script measures retrieval latency, throughput, memory and recall@k on the curated topic list.
+Ground truth for each topic is the guide section (or chapter) whose heading matches it. The guide can
+be replicated into synthetic corpora (e.g. 10x and 100x) to see how each retriever scales.
+
+It also compares the streaming .docx extractor with the python-docx object model it replaced,
+running each in a fresh process so startup time and peak RSS are its own.
+
+Usage: python benchmark.py [--document PATH] [--scales 1 10 100] [--extract-scales 1 10] [--k 5] [--json results.json]
+"""
+import os
+import gc
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import zipfile
+import resource
+import tempfile
+import subprocess
+import statistics
+import tracemalloc
+
+import document_processor
+from config import CURATED_TOPICS, DOCUMENT_PATH
+
+# Configure logging
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB."""
+    # Linux reports the high-water mark of the current program image here; ru_maxrss
+    # would also count the parent's footprint from before a subprocess exec
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def build_ground_truth(sections, topics):
+    """Map each topic to the set of (chapter, section) headings that match it.
+
+    Exact (case-insensitive) heading matches win; otherwise headings that contain
+    the topic are used. Topics with no matching heading are left out.
+    """
+    headings = []
+    for chapter_name, chapter_data in sections.items():
+        headings.append(((chapter_name, None), chapter_name.lower()))
+        for section_name in chapter_data["sections"]:
+            headings.append(((chapter_name, section_name), section_name.lower()))
+
+    truth = {}
+    for topic in topics:
+        topic_lower = topic.lower()
+        exact = {key for key, heading in headings if heading == topic_lower}
+        partial = {key for key, heading in headings if topic_lower in heading}
+        if exact or partial:
+            truth[topic] = exact or partial
+    return truth
+
+def make_synthetic_sections(sections, factor, seed=42):
+    """Grow the guide to factor times its size with distractor chapters.
+
+    Distractor lines keep the guide's line lengths and word distribution but are
+    drawn at random, so they add realistic posting-list load without duplicating
+    the sections that hold the ground truth.
+    """
+    rng = random.Random(seed)
+    words = [word for chapter_data in sections.values()
+             for lines in [chapter_data["content"], *chapter_data["sections"].values()]
+             for line in lines for word in line.split()]
+
+    def distractor(lines):
+        return [" ".join(rng.choices(words, k=len(line.split()))) for line in lines]
+
+    synthetic = dict(sections)
+    for copy in range(1, factor):
+        for number, chapter_data in enumerate(sections.values(), 1):
+            synthetic[f"Synthetic chapter {copy}-{number}"] = {
+                "content": distractor(chapter_data["content"]),
+                "sections": {
+                    f"Synthetic section {copy}-{number}-{i}": distractor(lines)
+                    for i, lines in enumerate(chapter_data["sections"].values(), 1)
+                },
+            }
+    return synthetic
+
+def load_corpus(sections, label):
+    """Point the document processor at an in-memory corpus."""
+    content = []
+    for number, (chapter_name, chapter_data) in enumerate(sections.items(), 1):
+        content.append(f"Chapter {number}. {chapter_name}")
+        content.extend(chapter_data["content"])
+        for section_name, lines in chapter_data["sections"].items():
+            content.append(section_name)
+            content.extend(lines)
+
+    # Set directly rather than published, so the search index is built inside the timed index build
+    document_processor.document_state = document_processor.DocumentState(content, sections,
+                                                                          f"benchmark-{label}-{len(content)}")
+    return content
+
+def chunk_tags(chunk_ids):
+    """Map chunk ids to their (chapter, section) tags."""
+    import rag_engine
+    index = rag_engine.active_snapshot.index
+    return [(index.chapters[chunk_id], index.sections[chunk_id]) for chunk_id in chunk_ids]
+
+def run_retriever(name, retrieve, truth, repeat):
+    """Time a retriever over every labelled topic and compute recall@k.
+
+    retrieve(topic) returns the (chapter, section) tags or text it found, and
+    is_hit decides whether the ground truth is among them. Queries are timed
+    without tracemalloc, whose hooks slow every allocation; peak allocation is
+    measured in one more pass over the topics, with the result caches cleared.
+    """
+    import rag_engine
+
+    latencies = []
+    hits = 0
+    started = time.perf_counter()
+
+    for pass_number in range(repeat):
+        for topic, expected in truth.items():
+            t0 = time.perf_counter()
+            found = retrieve(topic)
+            latencies.append(time.perf_counter() - t0)
+            if pass_number == 0 and is_hit(found, expected):
+                hits += 1
+
+    elapsed = time.perf_counter() - started
+
+    rag_engine.context_cache.clear()
+    document_processor.search_cache.clear()
+    tracemalloc.start()
+    for topic in truth:
+        retrieve(topic)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "retriever": name,
+        "queries": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "throughput_qps": len(latencies) / elapsed if elapsed else 0.0,
+        "peak_alloc_kb": peak / 1024,
+        "recall_at_k": hits / len(truth) if truth else 0.0,
+    }
+
+def is_hit(found, expected):
+    """A retrieval hits when any expected heading is among its tags, or named in its text."""
+    if isinstance(found, str):
+        found_lower = found.lower()
+        return any((section or chapter).lower() in found_lower for chapter, section in expected)
+    return any(tag in expected or (tag[0], None) in expected for tag in found)
+
+def benchmark_corpus(sections, label, k, repeat):
+    """Index one corpus and benchmark every retriever against it."""
+    # Imported here so the extractor child processes stay free of numpy and the index code
+    import rag_engine
+    
+    content = load_corpus(sections, label)
+    truth = build_ground_truth(sections, CURATED_TOPICS)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        gc.collect()
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        if not rag_engine.initialize_rag_engine(os.path.join(tmp, "index.bin"), os.path.join(tmp, "vectors"),
+                                                os.path.join(tmp, "topics.json")):
+            tracemalloc.stop()
+            raise RuntimeError(f"Could not index the {label} corpus")
+        document_processor.get_search_index()
+        build_seconds = time.perf_counter() - t0
+        _, build_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        retrievers = [
+            ("search_similar_chunks[lexical]", lambda q: chunk_tags(c for c, _ in rag_engine.rank_lexical(q, k))),
+            ("search_similar_chunks[dense]", lambda q: chunk_tags(c for c, _ in rag_engine.rank_dense(q, k))),
+            ("search_similar_chunks[hybrid]", lambda q: chunk_tags(c for c, _ in rag_engine.rank_hybrid(q, k))),
+            ("generate_context_for_query", rag_engine.build_context_for_query),
+            ("search_document", lambda q: [(r["chapter"], r["section"])
+                                           for r in document_processor.search_document(q, max_results=k)]),
+        ]
+        results = [run_retriever(name, retrieve, truth, repeat) for name, retrieve in retrievers]
+
+    return {
+        "corpus": label,
+        "lines": len(content),
+        "chunks": len(rag_engine.active_snapshot.index),
+        "labelled_topics": len(truth),
+        "build_seconds": build_seconds,
+        "build_peak_alloc_mb": build_peak / (1024 * 1024),
+        "peak_rss_mb": peak_rss_mb(),
+        "retrievers": results,
+    }
+
+def extract_with_python_docx(path):
+    """Baseline extractor: build the python-docx object model and walk its paragraphs."""
+    import docx
+    return [p.text.strip() for p in docx.Document(path).paragraphs if p.text.strip()]
+
+EXTRACTORS = {
+    "baseline": lambda path: [],
+    "stream": lambda path: document_processor.extract_docx(path)[0],
+    "python-docx": extract_with_python_docx,
+}
+
+def run_extraction(name, path):
+    """Run one extractor in this process and print its time and memory as a JSON line."""
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    lines = EXTRACTORS[name](path)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(json.dumps({"lines": len(lines), "seconds": elapsed, "peak_alloc_mb": peak / (1024 * 1024),
+                      "peak_rss_mb": peak_rss_mb()}))
+
+def make_scaled_docx(path, factor, out_path):
+    """Write a copy of a .docx whose body is repeated factor times."""
+    with zipfile.ZipFile(path) as source, zipfile.ZipFile(out_path, "w", zipfile.ZIP_DEFLATED) as target:
+        for item in source.infolist():
+            data = source.read(item.filename)
+            if item.filename == "word/document.xml" and factor > 1:
+                xml = data.decode("utf-8")
+                start = xml.index(">", xml.index("<w:body")) + 1
+                end = xml.rfind("<w:sectPr")
+                if end < start:
+                    end = xml.rindex("</w:body>")
+                data = (xml[:start] + xml[start:end] * factor + xml[end:]).encode("utf-8")
+            target.writestr(item, data)
+
+def benchmark_extraction(path, factors, repeat):
+    """Compare the extractors on the document scaled by each factor, one fresh process per run."""
+    reports = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for factor in factors:
+            scaled = os.path.join(tmp, f"guide_{factor}x.docx")
+            make_scaled_docx(path, factor, scaled)
+            
+            runs = {}
+            for name in EXTRACTORS:
+                results = []
+                for _ in range(repeat):
+                    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--extract", name,
+                                             "--document", scaled], capture_output=True, text=True, check=True)
+                    results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+                runs[name] = {
+                    "lines": results[0]["lines"],
+                    "seconds": statistics.median(r["seconds"] for r in results),
+                    "peak_alloc_mb": max(r["peak_alloc_mb"] for r in results),
+                    "peak_rss_mb": max(r["peak_rss_mb"] for r in results),
+                }
+            
+            # Interpreter and import overhead is the same for every extractor
+            baseline_rss = runs.pop("baseline")["peak_rss_mb"]
+            for run in runs.values():
+                run["rss_over_baseline_mb"] = run["peak_rss_mb"] - baseline_rss
+            reports.append({"document": f"{factor}x", "size_mb": os.path.getsize(scaled) / (1024 * 1024),
+                            "extractors": runs})
+    return reports
+
+def print_extraction_report(report):
+    """Print one extraction comparison as a table."""
+    print(f"\n== extraction, {report['document']} document ({report['size_mb']:.1f} MB .docx) ==")
+    print(f"{'extractor':14} {'lines':>8} {'seconds':>9} {'alloc MB':>9} {'RSS MB':>8} {'RSS over baseline':>18}")
+    for name, run in report["extractors"].items():
+        print(f"{name:14} {run['lines']:8d} {run['seconds']:9.3f} {run['peak_alloc_mb']:9.1f} "
+              f"{run['peak_rss_mb']:8.1f} {run['rss_over_baseline_mb']:18.1f}")
+
+def print_report(report, k):
+    """Print one corpus report as a table."""
+    print(f"\n== {report['corpus']}: {report['lines']} lines, {report['chunks']} chunks, "
+          f"{report['labelled_topics']} labelled topics ==")
+    print(f"index build {report['build_seconds']:.2f}s, build peak alloc {report['build_peak_alloc_mb']:.1f} MB, "
+          f"process peak RSS {report['peak_rss_mb']:.1f} MB")
+    print(f"{'retriever':32} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'q/s':>9} {'alloc KB':>9} {f'recall@{k}':>9}")
+    for r in report["retrievers"]:
+        print(f"{r['retriever']:32} {r['p50_ms']:8.3f} {r['p95_ms']:8.3f} {r['p99_ms']:8.3f} "
+              f"{r['throughput_qps']:9.1f} {r['peak_alloc_kb']:9.1f} {r['recall_at_k']:9.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MediQA retrieval on the curated topic list.")
+    parser.add_argument("--document", default=DOCUMENT_PATH, help="Path to the guidelines .docx")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100],
+                        help="Corpus sizes as multiples of the guide (default: 1 10 100)")
+    parser.add_argument("--k", type=int, default=5, help="Cut-off for recall@k and result count")
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the topic list per retriever")
+    parser.add_argument("--extract-scales", type=int, nargs="*", default=[1, 10],
+                        help="Document sizes for the extractor comparison (default: 1 10, none to skip)")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    parser.add_argument("--extract", choices=list(EXTRACTORS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    # Child process of the extractor comparison
+    if args.extract:
+        run_extraction(args.extract, args.document)
+        return 0
+    
+    extraction_reports = benchmark_extraction(args.document, args.extract_scales, args.repeat)
+    for report in extraction_reports:
+        print_extraction_report(report)
+
+    document_processor.DOCUMENT_PATH = args.document
+    if not document_processor.initialize_document_processor():
+        logger.error(f"Could not load the guide from {args.document}")
+        return 1
+    base_sections = document_processor.get_document_sections()
+
+    reports = []
+    for factor in args.scales:
+        sections = base_sections if factor == 1 else make_synthetic_sections(base_sections, factor)
+        report = benchmark_corpus(sections, f"{factor}x", args.k, args.repeat)
+        print_report(report, args.k)
+        reports.append(report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"extraction": extraction_reports, "retrieval": reports}, f, indent=2)
+        print(f"\nWrote results to {args.json}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,11 +14,59 @@ PGHOST = "ep-sparkling-mouse-a5arych6.us-east-2.aws.neon.tech"
 
 # Document configuration
 DOCUMENT_PATH = "attached_assets/pharmacy_guide.docx"
+CORPUS_MANIFEST_PATH = "attached_assets/corpus.json"  # Guideline books served side by side (defaults to DOCUMENT_PATH alone)
 
 # RAG configuration
 VECTOR_DB_PATH = "vector_db"
+SNAPSHOT_PATH = "vector_db/guide_snapshot.pkl"  # Parsed guide, keyed by the docx content hash
+INDEX_PATH = "vector_db/retrieval_index.bin"  # Flat chunk/postings file memory-mapped by every worker
+TOPIC_TABLE_PATH = "vector_db/topic_contexts.json"  # Precomputed context for each curated topic
+SHARD_ROOT = "vector_db/shards"  # Per-document index shards of the corpus
+SHARD_MEMORY_LIMIT_MB = 512  # Loaded shards beyond this footprint are evicted least recently used first
+SHARD_SEARCH_WORKERS = 4  # Threads searching corpus shards in parallel
+SHARD_SEARCH_LIMIT = 50  # Largest k a client may request from /api/search/corpus, ranked by every shard
 CHUNK_SIZE = 1500  # Increased for faster processing
 CHUNK_OVERLAP = 100  # Decreased for faster processing
+EMBEDDING_DIM = 512  # Hashed n-gram feature buckets per chunk vector
+EMBEDDING_DTYPE = "float16"  # Storage dtype of the memory-mapped embedding matrix
+CONTEXT_CACHE_SIZE = 256  # Maximum number of cached query contexts per worker
+CONTEXT_CACHE_TTL = 3600  # Seconds before a cached query context expires
+CONTEXT_TOKEN_BUDGET = 1500  # Approximate prompt tokens allowed for retrieved guideline context
+CONTEXT_DEDUP_THRESHOLD = 0.8  # Shared word 3-gram ratio above which a passage counts as a duplicate
+SEARCH_BATCH_LIMIT = 100  # Maximum number of queries accepted by /api/search/batch
+SEARCH_PAGE_SIZE = 5  # Results per /api/search page unless the client asks for another limit
+SEARCH_PAGE_LIMIT = 50  # Largest page a client may request from /api/search
+SEARCH_CACHE_SIZE = 256  # Ranked /api/search hit lists kept per worker for paging
+SEARCH_CACHE_TTL = 600  # Seconds a ranked hit list stays available to its cursors
+SNIPPET_CHARS = 160  # Characters of section text around a hit in each search snippet
+SNIPPETS_PER_RESULT = 3  # Snippet windows returned for each search result
+SEARCH_MAX_OFFSETS = 100  # Hit offsets listed per search result
+DOCUMENT_RELOAD_INTERVAL = 30  # Seconds between checks of the guidelines document for a new revision (0 disables)
+ADMIN_API_KEY = os.environ.get("ADMIN_API_KEY", "")  # Key for admin endpoints such as /api/admin/reload (empty disables them)
+
+# Curated guideline topics used for case simulations
+CURATED_TOPICS = [
+    "Diarrhoea", "Rotavirus Disease and Diarrhoea", "Constipation", "Peptic Ulcer Disease",
+    "Gastro-oesophageal Reflux Disease", "Haemorrhoids", "Vomiting", "Anaemia", "Measles", "Pertussis",
+    "Common cold", "Pneumonia", "Headache", "Boils", "Impetigo", "Buruli ulcer", "Yaws",
+    "Superficial Fungal Skin infections", "Pityriasis Versicolor", "Herpes Simplex Infections",
+    "Herpes Zoster Infections", "Chicken pox", "Large Chronic Ulcers", "Pruritus", "Urticaria",
+    "Reactive Erythema and Bullous Reaction", "Acne Vulgaris", "Eczema", "Intertrigo",
+    "Diabetes Mellitus", "Diabetic Ketoacidosis", "Diabetes in Pregnancy",
+    "Treatment-Induced Hypoglycemia", "Dyslipidaemia", "Goitre", "Hypothyroidism", "Hyperthyroidism",
+    "Overweight and Obesity", "Dysmenorrhoea", "Abortion", "Abnormal Vaginal Bleeding",
+    "Abnormal Vaginal Discharge", "Acute Lower Abdominal Pain", "Menopause", "Erectile Dysfunction",
+    "Urinary Tract Infection", "Sexually Transmitted Infections in Adults", "Fever", "Tuberculosis",
+    "Typhoid fever", "Malaria", "Uncomplicated Malaria", "Severe Malaria", "Malaria in Pregnancy",
+    "Worm Infestation", "Xerophthalmia", "Foreign body in the eye", "Neonatal conjunctivitis",
+    "Red eye", "Stridor", "Acute Epiglottitis", "Retropharyngeal Abscess",
+    "Pharyngitis and Tonsillitis", "Acute Sinusitis", "Acute otitis Media", "Chronic Otitis Media",
+    "Epistaxis", "Dental Caries", "Oral Candidiasis", "Acute Necrotizing Ulcerative Gingivitis",
+    "Acute Bacterial Sialoadenitis", "Chronic Periodontal Infections", "Mouth Ulcers",
+    "Odontogenic Infections", "Osteoarthritis", "Rheumatoid arthritis",
+    "Juvenile Idiopathic Arthritis", "Back pain", "Gout", "Dislocations", "Open Fractures",
+    "Cellulitis", "Burns", "Wounds", "Bites and Stings", "Shock", "Acute Allergic Reaction"
+]
 
 # Gamification settings
 DAILY_STREAK_POINTS = 10
@@ -0,0 +1,119 @@
+import re
+import math
+import logging
+import threading
+
+from config import CONTEXT_TOKEN_BUDGET, CONTEXT_DEDUP_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+WORD_PATTERN = re.compile(r"\S+\s*")
+SHINGLE_SIZE = 3
+
+# Running totals across every packed context in this worker
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "tokens_in": 0, "tokens_out": 0, "duplicates_dropped": 0, "passages_trimmed": 0}
+
+def estimate_tokens(text):
+    """Approximate the prompt token count of text without a tokenizer.
+
+    Words cost one token per four characters (at least one) and each
+    punctuation mark costs one, which tracks subword tokenizers closely on
+    English clinical text.
+    """
+    return sum(math.ceil(len(piece) / 4) for piece in TOKEN_PATTERN.findall(text))
+
+def shingles(text):
+    """Return the set of lowercase word 3-grams of text."""
+    words = text.lower().split()
+    if len(words) < SHINGLE_SIZE:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def is_near_duplicate(candidate, kept, threshold):
+    """True when most of the smaller shingle set is shared with an already kept passage."""
+    for other in kept:
+        smaller = min(len(candidate), len(other))
+        if smaller and len(candidate & other) / smaller >= threshold:
+            return True
+    return False
+
+def trim_to_tokens(text, budget):
+    """Cut text to at most budget tokens, preferring to end on a line or sentence."""
+    end = 0
+    used = 0
+    for match in WORD_PATTERN.finditer(text):
+        cost = estimate_tokens(match.group())
+        if used + cost > budget:
+            break
+        used += cost
+        end = match.end()
+
+    trimmed = text[:end].rstrip()
+    # Back off to the last line or sentence break if that keeps at least half
+    boundary = max(trimmed.rfind("\n"), trimmed.rfind(". ") + 1)
+    if boundary >= len(trimmed) // 2:
+        trimmed = trimmed[:boundary].rstrip()
+    return trimmed
+
+def pack_context(passages, budget=CONTEXT_TOKEN_BUDGET, dedup_threshold=CONTEXT_DEDUP_THRESHOLD):
+    """Pack scored passages into a context of at most budget tokens.
+
+    passages are (text, score) pairs. Higher-scoring passages are placed first,
+    near-duplicates of an already placed passage are dropped, and the first
+    passage that no longer fits is trimmed to the remaining budget.
+    Returns (context, report) where report counts the tokens saved.
+    """
+    ordered = sorted(passages, key=lambda passage: passage[1], reverse=True)
+    tokens_in = sum(estimate_tokens(text) for text, _ in ordered)
+
+    kept_texts = []
+    kept_shingles = []
+    used = 0
+    duplicates = 0
+    trimmed = 0
+    for text, _ in ordered:
+        passage_shingles = shingles(text)
+        if is_near_duplicate(passage_shingles, kept_shingles, dedup_threshold):
+            duplicates += 1
+            continue
+
+        cost = estimate_tokens(text)
+        if used + cost > budget:
+            text = trim_to_tokens(text, budget - used)
+            trimmed += 1
+            if text:
+                kept_texts.append(text)
+                used += estimate_tokens(text)
+            break
+
+        kept_texts.append(text)
+        kept_shingles.append(passage_shingles)
+        used += cost
+
+    context = "\n\n".join(kept_texts)
+    report = {
+        "tokens_in": tokens_in,
+        "tokens_out": used,
+        "tokens_saved": tokens_in - used,
+        "duplicates_dropped": duplicates,
+        "passages_trimmed": trimmed,
+    }
+
+    with _stats_lock:
+        _stats["requests"] += 1
+        _stats["tokens_in"] += tokens_in
+        _stats["tokens_out"] += used
+        _stats["duplicates_dropped"] += duplicates
+        _stats["passages_trimmed"] += trimmed
+
+    return context, report
+
+def get_packing_stats():
+    """Get running token totals for every context packed by this worker."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["tokens_saved"] = stats["tokens_in"] - stats["tokens_out"]
+    stats["avg_tokens_saved"] = stats["tokens_saved"] / stats["requests"] if stats["requests"] else 0.0
+    return stats
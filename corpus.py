@@ -0,0 +1,236 @@
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import document_processor
+import rag_engine
+from config import CORPUS_MANIFEST_PATH, SHARD_ROOT, SHARD_MEMORY_LIMIT_MB, SHARD_SEARCH_WORKERS
+from query_analysis import analyze_query
+
+logger = logging.getLogger(__name__)
+
+# Global variables
+manifest = None  # Documents in the corpus, read from CORPUS_MANIFEST_PATH on first use
+manifest_lock = threading.Lock()
+search_pool = ThreadPoolExecutor(max_workers=SHARD_SEARCH_WORKERS, thread_name_prefix="shard-search")
+
+def load_manifest(path=CORPUS_MANIFEST_PATH):
+    """Read the corpus manifest, a JSON object with a "documents" list of {id, title, path}.
+
+    Without a manifest the corpus is just the main guidelines document.
+    """
+    if not os.path.exists(path):
+        return [{"id": "stg", "title": "Standard Treatment Guidelines", "path": document_processor.DOCUMENT_PATH}]
+
+    with open(path) as f:
+        documents = json.load(f)["documents"]
+
+    seen = set()
+    for entry in documents:
+        if not entry.get("id") or not entry.get("path"):
+            raise ValueError(f"Corpus manifest entry needs an id and a path: {entry}")
+        if entry["id"] in seen:
+            raise ValueError(f"Duplicate document id in corpus manifest: {entry['id']}")
+        seen.add(entry["id"])
+        entry.setdefault("title", entry["id"])
+
+    logger.info(f"Loaded corpus manifest with {len(documents)} documents from {path}")
+    return documents
+
+def get_manifest():
+    """Get the corpus documents, reading the manifest on first use."""
+    global manifest
+
+    with manifest_lock:
+        if manifest is None:
+            manifest = load_manifest()
+        return manifest
+
+class Shard:
+    """One loaded document of the corpus: its retrieval snapshot plus an approximate memory footprint."""
+    __slots__ = ("doc_id", "title", "snapshot", "nbytes")
+
+    def __init__(self, doc_id, title, snapshot, nbytes=0):
+        self.doc_id = doc_id
+        self.title = title
+        self.snapshot = snapshot
+        self.nbytes = nbytes
+
+def shard_paths(doc_id):
+    """Return (snapshot_path, index_path, vector_path) for a document's shard files."""
+    root = os.path.join(SHARD_ROOT, doc_id)
+    return (os.path.join(root, "guide_snapshot.pkl"), os.path.join(root, "retrieval_index.bin"),
+            os.path.join(root, "vectors"))
+
+def file_size(path):
+    """Size of a file or of every file in a directory, 0 if it is missing."""
+    if os.path.isdir(path):
+        return sum(file_size(os.path.join(path, name)) for name in os.listdir(path))
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+def load_shard(entry):
+    """Parse and index one manifest document into a Shard, or return None on failure."""
+    doc_id = entry["id"]
+    snapshot_path, index_path, vector_path = shard_paths(doc_id)
+
+    document = document_processor.load_document(entry["path"], snapshot_path)
+    if document is None:
+        logger.error(f"Could not load corpus document {doc_id} from {entry['path']}")
+        return None
+
+    # Shards skip the curated topic table, which only the main document serves
+    snapshot = rag_engine.build_snapshot(document, (index_path, vector_path, None))
+    if snapshot is None:
+        return None
+
+    # Index and embeddings are memory-mapped, the parsed sections are about the size of their snapshot
+    nbytes = file_size(index_path) + file_size(vector_path) + file_size(snapshot_path)
+    logger.info(f"Loaded corpus shard {doc_id} with {len(snapshot.index)} chunks (~{nbytes // (1024 * 1024)} MB)")
+    return Shard(doc_id, entry["title"], snapshot, nbytes)
+
+class ShardCache:
+    """Thread-safe LRU of loaded shards, bounded by their combined memory footprint.
+
+    Shards load lazily on first use. When the footprint exceeds the limit the
+    least recently used shards are dropped; searches still holding one finish
+    normally and its memory maps close once the last reference goes away.
+    """
+
+    def __init__(self, limit_bytes):
+        self.limit_bytes = limit_bytes
+        self._shards = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}  # Document id -> lock held while that shard loads
+        self.loads = 0
+        self.evictions = 0
+
+    def get(self, entry):
+        """Return the loaded shard for a manifest entry, loading it if needed."""
+        doc_id = entry["id"]
+
+        # The main document is already served by the RAG engine, including hot reloads
+        if os.path.abspath(entry["path"]) == os.path.abspath(document_processor.DOCUMENT_PATH):
+            snapshot = rag_engine.active_snapshot
+            if snapshot is not None:
+                return Shard(doc_id, entry["title"], snapshot)
+
+        with self._lock:
+            shard = self._shards.get(doc_id)
+            if shard is not None:
+                self._shards.move_to_end(doc_id)
+                return shard
+            loading = self._loading.setdefault(doc_id, threading.Lock())
+
+        # Only one thread loads a given shard, others wait for it
+        with loading:
+            with self._lock:
+                shard = self._shards.get(doc_id)
+                if shard is not None:
+                    self._shards.move_to_end(doc_id)
+                    return shard
+
+            shard = load_shard(entry)
+            if shard is None:
+                return None
+
+            with self._lock:
+                self._shards[doc_id] = shard
+                self.loads += 1
+                self._evict()
+            return shard
+
+    def _evict(self):
+        """Drop least recently used shards until under the limit, always keeping the newest."""
+        total = sum(shard.nbytes for shard in self._shards.values())
+        while total > self.limit_bytes and len(self._shards) > 1:
+            doc_id, shard = self._shards.popitem(last=False)
+            total -= shard.nbytes
+            self.evictions += 1
+            logger.info(f"Evicted corpus shard {doc_id} to stay under {self.limit_bytes // (1024 * 1024)} MB")
+
+    def loaded(self):
+        """Ids of the shards currently loaded, least recently used first."""
+        with self._lock:
+            return list(self._shards)
+
+    def stats(self):
+        """Get load/eviction counters and the current footprint."""
+        with self._lock:
+            return {
+                "loaded": list(self._shards),
+                "bytes": sum(shard.nbytes for shard in self._shards.values()),
+                "limit_bytes": self.limit_bytes,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                # Spelling indexes are built in memory on first use and are not part of bytes
+                "spelling": {doc_id: rag_engine.get_spelling_stats(shard.snapshot)
+                             for doc_id, shard in self._shards.items()},
+            }
+
+shard_cache = ShardCache(SHARD_MEMORY_LIMIT_MB * 1024 * 1024)
+
+def search_shard(entry, query, k, mode, analysis):
+    """Rank one document's chunks for the query. Returns result dicts tagged with the document."""
+    shard = shard_cache.get(entry)
+    if shard is None:
+        return []
+
+    snapshot = shard.snapshot
+    if mode == "dense":
+        ranked = rag_engine.rank_dense(query, k, snapshot)
+    elif mode == "lexical":
+        ranked = rag_engine.rank_lexical(query, k, analysis, snapshot)
+    else:
+        ranked = rag_engine.rank_hybrid(query, k, analysis, snapshot)
+
+    index = snapshot.index
+    return [{
+        "document": shard.doc_id,
+        "title": shard.title,
+        "chapter": index.chapters[chunk_id],
+        "section": index.sections[chunk_id],
+        "content": index.texts[chunk_id],
+        "score": score,
+    } for chunk_id, score in ranked]
+
+def search_corpus(query, k=5, doc_ids=None, mode="hybrid"):
+    """Search every document of the corpus (or just doc_ids) in parallel and merge the top k.
+
+    Each shard is ranked on the shard pool and the per-shard top k lists are
+    merged by score. Hybrid scores are rank-based, which keeps them comparable
+    across shards with different term statistics.
+    """
+    entries = [entry for entry in get_manifest() if doc_ids is None or entry["id"] in doc_ids]
+    if not entries or k <= 0:
+        return []
+
+    analysis = analyze_query(query)
+    futures = [(entry["id"], search_pool.submit(search_shard, entry, query, k, mode, analysis)) for entry in entries]
+
+    results = []
+    for doc_id, future in futures:
+        try:
+            results.extend(future.result())
+        except Exception as e:
+            logger.error(f"Error searching corpus shard {doc_id}: {e}")
+
+    results.sort(key=lambda result: result["score"], reverse=True)
+    return results[:k]
+
+def get_corpus_documents():
+    """List the corpus documents and whether each one is loaded."""
+    loaded = set(shard_cache.loaded())
+    main_path = os.path.abspath(document_processor.DOCUMENT_PATH)
+    return [{
+        "id": entry["id"],
+        "title": entry["title"],
+        "loaded": entry["id"] in loaded or (os.path.abspath(entry["path"]) == main_path
+                                            and rag_engine.active_snapshot is not None),
+    } for entry in get_manifest()]
+
+def get_shard_stats():
+    """Get the shard cache's footprint, load/eviction counters and per-shard spelling index sizes."""
+    return shard_cache.stats()
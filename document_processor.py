@@ -1,36 +1,138 @@
 import os
+import re
 import logging
-import docx
-from config import DOCUMENT_PATH
+import hashlib
+import threading
+from cache import TTLCache
+from config import DOCUMENT_PATH, SNAPSHOT_PATH, SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, SEARCH_MAX_OFFSETS, SEARCH_PAGE_SIZE
+from docx_stream import iter_docx_blocks, heading_level
+from snapshot import hash_file, load_snapshot, save_snapshot
+from snippets import make_snippets, original_spans
+from text_arena import TextArena
 
 logger = logging.getLogger(__name__)
 
-# Global variables to store document content
-document_content = []
-document_sections = {}
+# Bump when parsing changes how the same document splits into chapters and sections
+PARSER_VERSION = 3
 
-def extract_text_from_docx(docx_path):
-    """Extract text from a .docx file."""
+# "Chapter 3. Skin Disorders" or "CHAPTER 3: SKIN DISORDERS" -> the chapter's name
+CHAPTER_PREFIX = re.compile(r"^chapter\s+\w+\s*[.:\-]\s*", re.IGNORECASE)
+
+class DocumentState:
+    """One parsed revision of the guidelines document.
+    
+    Replaced as a whole when the document is reloaded, so readers that take
+    the current state once never see the content of one revision with the
+    sections of another.
+    """
+    __slots__ = ("content", "sections", "hash", "tables")
+    
+    def __init__(self, content=None, sections=None, doc_hash=None, tables=None):
+        # Every line of the document in one string; sections hold views into it
+        self.content = content if content is not None else TextArena()
+        self.sections = sections if sections is not None else {}
+        self.hash = doc_hash
+        self.tables = tables if tables is not None else []  # {"rows", "chapter", "section"} for each table
+    
+    def astuple(self):
+        """Return (content, sections, doc_hash, tables), the shape load_document returns."""
+        return self.content, self.sections, self.hash, self.tables
+
+# The loaded document, swapped in a single assignment by publish_document
+document_state = DocumentState()
+search_index = None  # SectionSearchIndex for the current sections, rebuilt when they are replaced
+search_index_lock = threading.Lock()
+search_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)  # (index version, lowercased query) -> ranked hits
+
+def extract_docx(docx_path):
+    """Extract the non-empty paragraphs and the tables of a .docx file.
+    
+    Returns (lines, levels, tables) where levels[i] is the Heading style level
+    of lines[i], or 0 for body text, and tables holds (position, rows) pairs,
+    position being the number of lines before the table. The file is streamed,
+    not loaded as a DOM.
+    """
     try:
-        doc = docx.Document(docx_path)
-        text = []
-        
-        for paragraph in doc.paragraphs:
-            if paragraph.text.strip():
-                text.append(paragraph.text.strip())
+        lines = []
+        levels = []
+        tables = []
+        for kind, value, style in iter_docx_blocks(docx_path):
+            # Tables stay out of the text content and are kept separately
+            if kind == "table":
+                if value:
+                    tables.append((len(lines), value))
+            elif value.strip():
+                lines.append(value.strip())
+                levels.append(heading_level(style))
         
-        return text
+        return lines, levels, tables
     except Exception as e:
         logger.error(f"Error extracting text from document: {e}")
-        return []
+        return [], [], []
+
+def extract_text_from_docx(docx_path):
+    """Extract text from a .docx file."""
+    return extract_docx(docx_path)[0]
+
+def line_views(sections, arena):
+    """Replace the line numbers collected for each chapter intro and section with views into the arena."""
+    for chapter_data in sections.values():
+        chapter_data["content"] = arena.view(chapter_data["content"])
+        for section_name, line_numbers in chapter_data["sections"].items():
+            chapter_data["sections"][section_name] = arena.view(line_numbers)
+    return sections
+
+def parse_heading_structure(content, levels, owners=None):
+    """Parse chapters from Heading 1 paragraphs and sections from Heading 2 paragraphs.
+    
+    Deeper headings stay in the text of the section they belong to. If owners
+    is a list, the (chapter, section) in effect after each line is appended to it.
+    Returns the line numbers of each block; see parse_document_structure.
+    """
+    sections = {}
+    current_chapter = None
+    current_section = None
+    
+    for line_no, (line, level) in enumerate(zip(content, levels)):
+        if level == 1:
+            current_chapter = CHAPTER_PREFIX.sub("", line).strip() or line
+            current_section = None
+            sections.setdefault(current_chapter, {"sections": {}, "content": []})
+        elif level == 2 and current_chapter:
+            current_section = line
+            sections[current_chapter]["sections"].setdefault(current_section, [])
+        elif current_chapter:
+            if current_section:
+                sections[current_chapter]["sections"][current_section].append(line_no)
+            else:
+                sections[current_chapter]["content"].append(line_no)
+        
+        if owners is not None:
+            owners.append((current_chapter, current_section))
+    
+    return sections
 
-def parse_document_structure(content):
-    """Parse the document to identify chapters and sections."""
+def parse_document_structure(content, levels=None, owners=None):
+    """Parse the document to identify chapters and sections.
+    
+    Heading styles drive the structure when the document marks chapters with
+    Heading 1; otherwise chapters are found by their "Chapter N." prefix and
+    short lines become sections.
+    If owners is a list, the (chapter, section) in effect after each line is appended to it.
+    
+    The lines of each chapter intro and section are LineViews into content,
+    which is turned into a TextArena first if it is a plain list.
+    """
+    arena = content if isinstance(content, TextArena) else TextArena(content)
+    # Chapters come from Heading 1, so a guide that only styles deeper headings keeps the heuristic
+    if levels and 1 in levels:
+        return line_views(parse_heading_structure(arena, levels, owners), arena)
+    
     sections = {}
     current_chapter = None
     current_section = None
     
-    for line in content:
+    for line_no, line in enumerate(arena):
         # Check for chapter headings
         if line.startswith("Chapter "):
             parts = line.split(".")
@@ -46,80 +148,268 @@ def parse_document_structure(content):
         # Add content to current section or chapter
         elif current_chapter:
             if current_section:
-                sections[current_chapter]["sections"][current_section].append(line)
+                sections[current_chapter]["sections"][current_section].append(line_no)
             else:
-                sections[current_chapter]["content"].append(line)
+                sections[current_chapter]["content"].append(line_no)
+        
+        if owners is not None:
+            owners.append((current_chapter, current_section))
     
-    return sections
+    return line_views(sections, arena)
 
-def initialize_document_processor():
-    """Initialize the document processor by loading and parsing the document."""
-    global document_content, document_sections
+def place_tables(tables, owners):
+    """Attach to each (position, rows) table the chapter and section of the line before it."""
+    placed = []
+    for position, rows in tables:
+        chapter, section = owners[position - 1] if position else (None, None)
+        placed.append({"rows": rows, "chapter": chapter, "section": section})
+    return placed
+
+def load_document(path, snapshot_path=SNAPSHOT_PATH):
+    """Load and parse a guidelines document, reusing its snapshot when the file is unchanged.
     
-    if not os.path.exists(DOCUMENT_PATH):
-        logger.error(f"Document not found at {DOCUMENT_PATH}")
-        return False
+    Returns (content, sections, doc_hash, tables), or None if the document cannot be read.
+    """
+    if not os.path.exists(path):
+        logger.error(f"Document not found at {path}")
+        return None
     
-    logger.info(f"Loading document from {DOCUMENT_PATH}")
-    document_content = extract_text_from_docx(DOCUMENT_PATH)
+    # Reuse the parsed content from the last boot if the document hasn't changed
+    doc_hash = hash_file(path)
+    snapshot = load_snapshot(doc_hash, snapshot_path)
+    if snapshot and "tables" in snapshot and snapshot.get("parser") == PARSER_VERSION:
+        content = snapshot["paragraphs"]
+        sections = snapshot["sections"]
+        tables = snapshot["tables"]
+        logger.info(f"Loaded document snapshot with {len(content)} lines, {len(sections)} chapters "
+                    f"and {len(tables)} tables")
+        return content, sections, doc_hash, tables
     
-    if not document_content:
+    logger.info(f"Loading document from {path}")
+    lines, levels, tables = extract_docx(path)
+    
+    if not lines:
         logger.error("Failed to extract content from document")
-        return False
+        return None
+    
+    # One string for the whole document; the per-line strings are dropped with lines
+    content = TextArena(lines)
+    del lines
+    logger.info(f"Successfully loaded document with {len(content)} lines ({len(content.text)} characters)")
     
-    logger.info(f"Successfully loaded document with {len(document_content)} lines")
+    # Parse document structure, noting where each line falls so tables can be placed
+    owners = []
+    sections = parse_document_structure(content, levels, owners)
+    tables = place_tables(tables, owners)
+    logger.info(f"Parsed document into {len(sections)} chapters with {len(tables)} tables")
     
-    # Parse document structure
-    document_sections = parse_document_structure(document_content)
-    logger.info(f"Parsed document into {len(document_sections)} chapters")
+    save_snapshot(doc_hash, snapshot_path, paragraphs=content, sections=sections, tables=tables,
+                  parser=PARSER_VERSION)
+    
+    return content, sections, doc_hash, tables
+
+def initialize_document_processor():
+    """Initialize the document processor by loading and parsing the document."""
+    document = load_document(DOCUMENT_PATH)
+    if document is None:
+        return False
     
+    publish_document(DocumentState(*document))
     return True
 
+def publish_document(state):
+    """Make a fully parsed DocumentState the one every reader sees, in a single assignment."""
+    global document_state
+    
+    document_state = state
+    # Build the search index now rather than on the first search request
+    get_search_index()
+
+def get_document_state():
+    """Get the current DocumentState; read it once to use several of its parts together."""
+    return document_state
+
 def get_document_content():
     """Get the full document content."""
-    return document_content
+    return document_state.content
 
 def get_document_sections():
     """Get the parsed document sections."""
-    return document_sections
+    return document_state.sections
+
+def get_document_tables():
+    """Get the tables of the loaded document with the chapter and section each appears under."""
+    return document_state.tables
+
+def get_document_hash():
+    """Get the content hash of the loaded document."""
+    return document_state.hash
+
+def get_document_mtime():
+    """Get the modification time of the document on disk, or None if it is missing."""
+    try:
+        return os.path.getmtime(DOCUMENT_PATH)
+    except OSError:
+        return None
+
+def document_changed(doc_hash=None):
+    """Check whether the document on disk differs from doc_hash (by default the loaded one)."""
+    if not os.path.exists(DOCUMENT_PATH):
+        return False
+    return hash_file(DOCUMENT_PATH) != (doc_hash or document_state.hash)
 
 def get_section_content(chapter, section=None):
     """Get content for a specific chapter and section."""
-    if chapter in document_sections:
-        if section and section in document_sections[chapter]["sections"]:
-            return document_sections[chapter]["sections"][section]
+    sections = document_state.sections
+    if chapter in sections:
+        if section and section in sections[chapter]["sections"]:
+            return sections[chapter]["sections"][section]
         else:
-            return document_sections[chapter]["content"]
+            return sections[chapter]["content"]
     return []
 
+class SectionSearchIndex:
+    """Lowercased text of every chapter intro and section, with a suffix array over them.
+    
+    Built once per parsed document so search_document never re-joins or
+    lowercases the corpus per request. blocks[i] is the (chapter, section)
+    of text i, in document order. version is derived from the text, so every
+    worker serving the same document agrees on it and on search cursors.
+    """
+    __slots__ = ("sections", "blocks", "substrings", "version")
+    
+    def __init__(self, sections):
+        # numpy is only needed once searching starts, so plain document extraction stays light
+        from suffix_array import SubstringIndex
+        
+        self.sections = sections
+        self.blocks = []
+        texts = []
+        for chapter_name, chapter_data in sections.items():
+            self.blocks.append((chapter_name, None))
+            texts.append(" ".join(chapter_data["content"]).lower())
+            for section_name, section_content in chapter_data["sections"].items():
+                self.blocks.append((chapter_name, section_name))
+                texts.append(" ".join(section_content).lower())
+        self.substrings = SubstringIndex(texts)
+        self.version = hashlib.sha1(self.substrings.text.encode("utf-8")).hexdigest()[:12]
+    
+    def block_lines(self, block_id):
+        """Return the lines of one chapter intro or section."""
+        chapter_name, section_name = self.blocks[block_id]
+        chapter_data = self.sections[chapter_name]
+        return chapter_data["content"] if section_name is None else chapter_data["sections"][section_name]
+
+def get_search_index():
+    """Get the search index for the current document sections, building it on first use."""
+    global search_index
+    
+    sections = document_state.sections
+    index = search_index
+    if index is not None and index.sections is sections:
+        return index
+    
+    with search_index_lock:
+        if search_index is None or search_index.sections is not sections:
+            search_index = SectionSearchIndex(sections)
+            # Rankings of the previous version can no longer be paged through
+            search_cache.clear()
+            logger.info(f"Built search index over {len(search_index.blocks)} chapter and section texts")
+        return search_index
+
+def rank_blocks(index, query_lower):
+    """Rank the blocks containing a lowercased query as (block_id, relevance, offsets), most relevant first.
+    
+    Relevance is the number of non-overlapping occurrences, and offsets are
+    where the first SEARCH_MAX_OFFSETS of them start in the block's lowercased
+    text. Blocks of equal relevance
+    keep document order. Rankings are cached per index version, so paging
+    through one never re-runs the search.
+    """
+    key = (index.version, query_lower)
+    ranked = search_cache.get(key)
+    if ranked is not None:
+        return ranked
+    
+    if query_lower:
+        matches = index.substrings.matches(query_lower)
+        # Keep only the offsets a page can show; a copy, so the cache does not pin the full match arrays
+        ranked = [(block_id, len(offsets), offsets[:SEARCH_MAX_OFFSETS].copy())
+                  for block_id, offsets in sorted(matches.items())]
+    else:
+        # Like str.count, the empty query occurs once per character boundary and has no useful offsets
+        ranked = [(block_id, count, ()) for block_id, count in sorted(index.substrings.counts("").items())]
+    
+    ranked.sort(key=lambda hit: hit[1], reverse=True)
+    search_cache.set(key, ranked)
+    return ranked
+
 def search_document(query, max_results=5):
-    """Simple search function to find relevant sections for a query."""
+    """Simple search function to find relevant sections for a query.
+    
+    Relevance is the number of non-overlapping, case-insensitive occurrences
+    of the query in the chapter intro or section text.
+    """
+    index = get_search_index()
     results = []
+    for block_id, relevance, _ in rank_blocks(index, query.lower())[:max_results]:
+        chapter_name, section_name = index.blocks[block_id]
+        results.append({
+            "chapter": chapter_name,
+            "section": section_name,
+            "relevance": relevance
+        })
+    return results
+
+def get_search_cache_stats():
+    """Get hit/miss statistics for the cached search rankings."""
+    return search_cache.stats()
+
+def encode_cursor(index, position):
+    """Make the opaque cursor for the page of results starting at position."""
+    return f"{index.version}.{position}"
+
+def decode_cursor(cursor, index):
+    """Return the result position a cursor points at. Raises ValueError if it is malformed or stale."""
+    version, _, position = str(cursor).partition(".")
+    if not position.isdigit():
+        raise ValueError("Invalid search cursor")
+    if version != index.version:
+        raise ValueError("Search cursor has expired because the document changed, start the search again")
+    return int(position)
+
+def search_document_page(query, limit=SEARCH_PAGE_SIZE, cursor=None):
+    """Search the document and return one page of results with hit offsets and highlighted snippets.
     
-    # Convert query to lowercase for case-insensitive search
+    Each result has the chapter, section and relevance of search_document,
+    plus "hits" as [start, end] character ranges in the section's text (its
+    lines joined by spaces, at most SEARCH_MAX_OFFSETS of them) and
+    "snippets" around the first hits. next_cursor fetches the following
+    page, or is None after the last one. Raises ValueError for a bad cursor.
+    """
+    index = get_search_index()
     query_lower = query.lower()
+    start = decode_cursor(cursor, index) if cursor else 0
+    ranked = rank_blocks(index, query_lower)
+    page = ranked[start:start + limit]
     
-    # Search through chapters and sections
-    for chapter_name, chapter_data in document_sections.items():
-        # Search in chapter content
-        chapter_text = " ".join(chapter_data["content"])
-        if query_lower in chapter_text.lower():
-            results.append({
-                "chapter": chapter_name,
-                "section": None,
-                "relevance": chapter_text.lower().count(query_lower)
-            })
-        
-        # Search in sections
-        for section_name, section_content in chapter_data["sections"].items():
-            section_text = " ".join(section_content)
-            if query_lower in section_text.lower():
-                results.append({
-                    "chapter": chapter_name,
-                    "section": section_name,
-                    "relevance": section_text.lower().count(query_lower)
-                })
-    
-    # Sort by relevance and limit results
-    results.sort(key=lambda x: x["relevance"], reverse=True)
-    return results[:max_results]
+    results = []
+    for block_id, relevance, offsets in page:
+        chapter_name, section_name = index.blocks[block_id]
+        # Only the sections on this page are joined again, in their original case
+        text = " ".join(index.block_lines(block_id))
+        spans = original_spans(text, [int(offset) for offset in offsets], len(query_lower))
+        results.append({
+            "chapter": chapter_name,
+            "section": section_name,
+            "relevance": relevance,
+            "hits": [[hit_start, hit_end] for hit_start, hit_end in spans],
+            "snippets": make_snippets(text, spans),
+        })
+    
+    end = start + len(page)
+    return {
+        "results": results,
+        "total": len(ranked),
+        "next_cursor": encode_cursor(index, end) if end < len(ranked) else None,
+    }
@@ -0,0 +1,90 @@
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+DOCUMENT_PART = "word/document.xml"
+STYLES_PART = "word/styles.xml"
+
+HEADING_STYLE = re.compile(r"^heading\s+(\d)$", re.IGNORECASE)
+
+def read_style_names(archive):
+    """Map style ids to style names from the styles part, if the package has one."""
+    if STYLES_PART not in archive.namelist():
+        return {}
+
+    names = {}
+    with archive.open(STYLES_PART) as f:
+        for _, elem in ET.iterparse(f):
+            if elem.tag == W + "style":
+                name = elem.find(W + "name")
+                names[elem.get(W + "styleId")] = name.get(W + "val") if name is not None else elem.get(W + "styleId")
+                elem.clear()
+    return names
+
+def heading_level(style_name):
+    """Return the outline level of a Heading style name, or 0 for any other style."""
+    match = HEADING_STYLE.match(style_name or "")
+    return int(match.group(1)) if match else 0
+
+def paragraph_text(p):
+    """Concatenate the visible text of a w:p element the way Word displays it."""
+    parts = []
+    for elem in p.iter():
+        if elem.tag == W + "t":
+            parts.append(elem.text or "")
+        elif elem.tag == W + "tab":
+            parts.append("\t")
+        elif elem.tag in (W + "br", W + "cr"):
+            parts.append("\n")
+    return "".join(parts)
+
+def paragraph_style(p, style_names):
+    """Return the style name of a w:p element, or None for the default style."""
+    style = p.find(f"{W}pPr/{W}pStyle")
+    if style is None:
+        return None
+    style_id = style.get(W + "val")
+    return style_names.get(style_id, style_id)
+
+def table_rows(tbl):
+    """Return the rows of a w:tbl element as lists of cell texts."""
+    rows = []
+    for tr in tbl.iter(W + "tr"):
+        rows.append(["\n".join(paragraph_text(p) for p in tc.iter(W + "p")).strip()
+                     for tc in tr.iter(W + "tc")])
+    return rows
+
+def iter_docx_blocks(path):
+    """Stream the body of a .docx file block by block, in document order.
+
+    Yields ("paragraph", text, style_name) and ("table", rows, None) tuples.
+    word/document.xml is parsed incrementally and each top-level block is
+    discarded once yielded, so memory stays flat however long the document is.
+    Like python-docx's Document.paragraphs, only paragraphs directly in the body
+    are yielded; paragraphs inside tables arrive as part of their table.
+    """
+    with zipfile.ZipFile(path) as archive:
+        style_names = read_style_names(archive)
+
+        with archive.open(DOCUMENT_PART) as f:
+            depth = 0
+            body = None
+            body_depth = None
+            for event, elem in ET.iterparse(f, events=("start", "end")):
+                if event == "start":
+                    depth += 1
+                    if elem.tag == W + "body":
+                        body, body_depth = elem, depth
+                    continue
+
+                depth -= 1
+                if body is None or depth != body_depth:
+                    continue
+
+                # A complete top-level block of the body
+                if elem.tag == W + "p":
+                    yield "paragraph", paragraph_text(elem), paragraph_style(elem, style_names)
+                elif elem.tag == W + "tbl":
+                    yield "table", table_rows(elem), None
+                body.remove(elem)
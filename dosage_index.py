@@ -0,0 +1,227 @@
+import re
+
+from aho_corasick import AhoCorasick
+
+# Header keywords that identify the columns of a dosage table
+DRUG_HEADERS = ("medicine", "drug", "medication", "agent")
+CONDITION_HEADERS = ("condition", "indication", "diagnosis", "disease")
+ROUTE_HEADERS = ("route",)
+FREQUENCY_HEADERS = ("frequency", "interval")
+DURATION_HEADERS = ("duration",)
+DOSE_HEADERS = ("dose", "dosage", "dosing", "strength")
+POPULATION_HEADERS = ("adult", "child", "paediatric", "pediatric", "infant", "neonate", "weight", "age")
+
+# Words naming the paediatric patient groups that dose tables often list separately
+CHILD_WORDS = ("child", "paediatric", "pediatric", "infant", "neonat", "baby", "babies")
+
+MAX_DOSE_ROWS = 8  # Rows returned for one query, which keeps injected prompts short
+
+def normalize_name(text):
+    """Casefold a drug or condition name and drop bracketed notes and stray punctuation."""
+    text = re.sub(r"\([^)]*\)", " ", text.lower())
+    text = re.sub(r"[^\w+/\- ]", " ", text)
+    return " ".join(text.split())
+
+def mentions_child(text):
+    """True if text names a paediatric patient group, matching word prefixes like column_kind."""
+    return any(word.startswith(CHILD_WORDS) for word in re.findall(r"[a-z]+", text.lower()))
+
+def column_kind(header):
+    """Classify a table header cell, or None for columns the index does not keep."""
+    # Keywords match word prefixes, so "Drugs" and "Children" count but "Dosage" is not an "age" column
+    words = re.findall(r"[a-z]+", header.lower())
+    for kind, keywords in (("drug", DRUG_HEADERS), ("condition", CONDITION_HEADERS), ("route", ROUTE_HEADERS),
+                           ("frequency", FREQUENCY_HEADERS), ("duration", DURATION_HEADERS),
+                           ("population", POPULATION_HEADERS), ("dose", DOSE_HEADERS)):
+        if any(word.startswith(keyword) for word in words for keyword in keywords):
+            return kind
+    return None
+
+class DoseRow:
+    """One dose of one drug from a guideline table, with where in the guide it came from."""
+    __slots__ = ("drug", "condition", "dose", "population", "frequency", "duration", "route", "chapter", "section")
+
+    def __init__(self, drug, condition, dose, population=None, frequency=None, duration=None, route=None,
+                 chapter=None, section=None):
+        self.drug = drug
+        self.condition = condition
+        self.dose = dose
+        self.population = population  # Header of the dose column when the table splits doses by patient group
+        self.frequency = frequency
+        self.duration = duration
+        self.route = route
+        self.chapter = chapter
+        self.section = section
+
+    def to_dict(self):
+        """Convert the row to a JSON-serializable dictionary."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def format(self):
+        """Render the row as one line of plain text for prompts and direct answers."""
+        dose = f"{self.population}: {self.dose}" if self.population else self.dose
+        details = [part for part in (self.route, self.frequency, self.duration) if part]
+        if details:
+            dose = f"{dose}, {', '.join(details)}"
+        source = " > ".join(part for part in (self.chapter, self.section) if part)
+        line = f"{self.drug} for {self.condition}: {dose}" if self.condition else f"{self.drug}: {dose}"
+        return f"{line} ({source})" if source else line
+
+def find_header(rows):
+    """Return (header_row_index, column_kinds) for a dosage table, or None if the table is not one."""
+    for row_index, row in enumerate(rows[:2]):
+        kinds = [column_kind(cell) for cell in row]
+        if "drug" in kinds and ("dose" in kinds or "population" in kinds):
+            return row_index, kinds
+    return None
+
+def parse_dose_table(table):
+    """Turn one extracted table into DoseRows. Tables without drug and dose columns yield nothing.
+
+    table is a dict with the table's "rows" and the "chapter" and "section" it
+    appears under. The section names the condition unless the table has its own
+    condition column. Empty drug cells (vertically merged in Word) repeat the
+    drug of the row above.
+    """
+    rows = table["rows"]
+    found = find_header(rows)
+    if found is None:
+        return []
+
+    header_index, kinds = found
+    header = rows[header_index]
+    default_condition = table.get("section") or table.get("chapter")
+
+    dose_rows = []
+    drug = None
+    for row in rows[header_index + 1:]:
+        if row == header:
+            continue  # Header repeated at a page break
+        cells = dict.fromkeys(("drug", "condition", "route", "frequency", "duration"))
+        doses = []
+        for column, cell in enumerate(row[:len(kinds)]):
+            kind = kinds[column]
+            if not cell or kind is None:
+                continue
+            if kind == "dose":
+                doses.append((None, cell))
+            elif kind == "population":
+                doses.append((header[column], cell))
+            else:
+                cells[kind] = cell
+
+        drug = cells["drug"] or drug
+        if not drug:
+            continue
+        for population, dose in doses:
+            dose_rows.append(DoseRow(drug, cells["condition"] or default_condition, dose, population,
+                                     cells["frequency"], cells["duration"], cells["route"],
+                                     table.get("chapter"), table.get("section")))
+    return dose_rows
+
+class DosageIndex:
+    """Dose rows from the guide's tables, keyed by normalized drug and condition (or section) name.
+
+    An automaton over every drug and condition name finds the ones a query
+    mentions in one pass, so dose questions resolve without retrieval or an
+    LLM round-trip.
+    """
+    __slots__ = ("rows", "by_drug", "by_condition", "matcher")
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.by_drug = {}
+        self.by_condition = {}
+        for row_id, row in enumerate(rows):
+            self.by_drug.setdefault(normalize_name(row.drug), []).append(row_id)
+            # Rows with their own condition column are also found by the section they sit in
+            for name in {normalize_name(name) for name in (row.condition, row.section) if name}:
+                self.by_condition.setdefault(name, []).append(row_id)
+
+        patterns = [(name, ("drug", name)) for name in self.by_drug]
+        patterns.extend((name, ("condition", name)) for name in self.by_condition)
+        self.matcher = AhoCorasick(patterns)
+
+    @classmethod
+    def from_tables(cls, tables):
+        """Build the index from the tables extracted by the document processor."""
+        rows = []
+        for table in tables:
+            rows.extend(parse_dose_table(table))
+        return cls(rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def drugs(self):
+        """Sorted normalized names of every indexed drug."""
+        return sorted(self.by_drug)
+
+    def match(self, text):
+        """Return the (drug names, condition names) mentioned in text as whole words, in order of appearance."""
+        drugs = []
+        conditions = []
+        for _, _, (kind, name) in self.matcher.iter_matches(normalize_name(text), whole_words=True):
+            found = drugs if kind == "drug" else conditions
+            if name not in found:
+                found.append(name)
+        return drugs, conditions
+
+    def resolve(self, name, kind):
+        """Map a user-supplied drug or condition name to the row ids of the names it contains."""
+        keys = self.by_drug if kind == "drug" else self.by_condition
+        name = normalize_name(name)
+        if name in keys:
+            return set(keys[name])
+        row_ids = set()
+        for _, _, (matched_kind, matched) in self.matcher.iter_matches(name, whole_words=True):
+            if matched_kind == kind:
+                row_ids.update(keys[matched])
+        return row_ids
+
+    def lookup(self, drug=None, condition=None, limit=None):
+        """Return the rows for a drug, a condition, or both, in document order."""
+        if not drug and not condition:
+            return []
+        row_ids = None
+        if drug:
+            row_ids = self.resolve(drug, "drug")
+        if condition:
+            condition_ids = self.resolve(condition, "condition")
+            row_ids = condition_ids if row_ids is None else row_ids & condition_ids
+        return [self.rows[row_id] for row_id in sorted(row_ids)[:limit]]
+
+    def rows_for_query(self, text, limit=MAX_DOSE_ROWS):
+        """Return the rows a free-text question asks about.
+
+        Rows matching both a mentioned drug and a mentioned condition win; a
+        drug named on its own returns all its rows, a condition on its own all
+        of its drugs.
+        """
+        drugs, conditions = self.match(text)
+        drug_ids = set()
+        for name in drugs:
+            drug_ids.update(self.by_drug[name])
+        condition_ids = set()
+        for name in conditions:
+            condition_ids.update(self.by_condition[name])
+
+        row_ids = (drug_ids & condition_ids) or drug_ids or condition_ids
+        return [self.rows[row_id] for row_id in sorted(row_ids)[:limit]]
+
+    def covers_query(self, text, rows, topics=()):
+        """True if rows answer every condition and patient group a question mentions.
+
+        The conditions are those in the index that text names plus topics, such
+        as the curated topics found in the question. rows_for_query falls back
+        to every row of a drug when no table covers the named condition, and
+        those rows must not be passed off as the answer for it. A question
+        about children is only covered by rows with a paediatric dose column.
+        """
+        returned = {id(row) for row in rows}
+        for name in [*self.match(text)[1], *topics]:
+            if not any(id(self.rows[row_id]) in returned for row_id in self.resolve(name, "condition")):
+                return False
+        if mentions_child(text):
+            return any(row.population and mentions_child(row.population) for row in rows)
+        return True
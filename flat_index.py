@@ -0,0 +1,251 @@
+import os
+import sys
+import json
+import mmap
+import struct
+import logging
+from array import array
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"MQIDX001"
+FORMAT_VERSION = 3
+ALIGNMENT = 8
+PREAMBLE = struct.Struct("<8sQ")  # Magic, header length
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+class StringView:
+    """Read-only sequence of strings stored as UTF-8 in one arena plus an offsets array.
+
+    Strings are only decoded when indexed, so the arena itself can live in a
+    shared memory map. With optional=True empty strings read back as None.
+    """
+    __slots__ = ("arena", "offsets", "optional")
+
+    def __init__(self, arena, offsets, optional=False):
+        self.arena = arena
+        self.offsets = offsets
+        self.optional = optional
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("string index out of range")
+        value = str(self.arena[self.offsets[i]:self.offsets[i + 1]], "utf-8")
+        return value if value or not self.optional else None
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def raw(self, i):
+        """Return the UTF-8 bytes of item i without decoding."""
+        return bytes(self.arena[self.offsets[i]:self.offsets[i + 1]])
+
+def pack_strings(strings):
+    """Pack strings into a UTF-8 arena and an offsets array ('Q', len + 1)."""
+    arena = bytearray()
+    offsets = array('Q', [0])
+    for value in strings:
+        arena += (value or "").encode("utf-8")
+        offsets.append(len(arena))
+    return arena, offsets
+
+def write_flat_file(path, arrays, meta):
+    """Write named arrays and a JSON metadata dict into one aligned flat file.
+
+    arrays maps names to array.array or bytes-like objects. The file is written
+    to a temporary path and renamed, so readers never see a partial file.
+    """
+    layout = {}
+    offset = 0
+    for name, values in arrays.items():
+        typecode = values.typecode if isinstance(values, array) else 'B'
+        nbytes = len(values) * (values.itemsize if isinstance(values, array) else 1)
+        layout[name] = {"typecode": typecode, "offset": offset, "nbytes": nbytes}
+        offset = _align(offset + nbytes)
+
+    header = json.dumps({
+        "format": FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "meta": meta,
+        "arrays": layout,
+    }).encode("utf-8")
+    data_start = _align(PREAMBLE.size + len(header))
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(PREAMBLE.pack(MAGIC, len(header)))
+        f.write(header)
+        for name, values in arrays.items():
+            f.seek(data_start + layout[name]["offset"])
+            f.write(values.tobytes() if isinstance(values, array) else bytes(values))
+    os.replace(tmp_path, path)
+
+    logger.info(f"Wrote flat index with {len(arrays)} arrays ({data_start + offset} bytes) to {path}")
+
+def open_flat_file(path):
+    """Memory-map a flat file read-only. Returns (meta, arrays) with arrays as typed memoryviews."""
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, header_len = PREAMBLE.unpack_from(mapped, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a flat index file")
+
+    header = json.loads(mapped[PREAMBLE.size:PREAMBLE.size + header_len])
+    if header.get("format") != FORMAT_VERSION or header.get("byteorder") != sys.byteorder:
+        raise ValueError(f"{path} was written in an incompatible format")
+
+    data_start = _align(PREAMBLE.size + header_len)
+    buffer = memoryview(mapped)
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        start = data_start + spec["offset"]
+        arrays[name] = buffer[start:start + spec["nbytes"]].cast(spec["typecode"])
+
+    return header["meta"], arrays
+
+class FlatIndex:
+    """Read-only retrieval index backed by a memory-mapped flat file.
+
+    Every worker that opens the same file shares one physical copy through the
+    page cache. Terms are stored sorted, so term lookup is a binary search over
+    the term arena, and postings are laid out CSR-style: for term t,
+    post_chunks[post_offsets[t]:post_offsets[t + 1]] are the ascending chunk ids
+    and, for posting p, positions[pos_offsets[p]:pos_offsets[p + 1]] are the
+    token positions of t in that chunk. post_weights[p] is the precomputed BM25
+    weight of posting p, which makes the postings a term x chunk CSR matrix.
+    """
+    __slots__ = ("meta", "texts", "chapters", "sections", "terms", "idf", "max_scores",
+                 "doc_lengths", "has_treatment", "has_diagnosis", "post_offsets", "post_chunks",
+                 "post_weights", "pos_offsets", "positions", "avgdl")
+
+    def __init__(self, meta, arrays):
+        self.meta = meta
+        self.texts = StringView(arrays["text_arena"], arrays["text_offsets"])
+        self.chapters = StringView(arrays["chapter_arena"], arrays["chapter_offsets"], optional=True)
+        self.sections = StringView(arrays["section_arena"], arrays["section_offsets"], optional=True)
+        self.terms = StringView(arrays["term_arena"], arrays["term_offsets"])
+        self.idf = arrays["idf"]
+        self.max_scores = arrays["max_scores"]
+        self.doc_lengths = arrays["doc_lengths"]
+        self.has_treatment = arrays["has_treatment"]
+        self.has_diagnosis = arrays["has_diagnosis"]
+        self.post_offsets = arrays["post_offsets"]
+        self.post_chunks = arrays["post_chunks"]
+        self.post_weights = arrays["post_weights"]
+        self.pos_offsets = arrays["pos_offsets"]
+        self.positions = arrays["positions"]
+        self.avgdl = meta.get("avgdl", 0.0)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def term_id(self, term):
+        """Return the id of a term, or None if it is not in the index."""
+        key = term.encode("utf-8")
+        lo, hi = 0, len(self.terms)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.terms.raw(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.terms) and self.terms.raw(lo) == key:
+            return lo
+        return None
+
+    def doc_freq(self, term_id):
+        """Return the number of chunks containing a term."""
+        return self.post_offsets[term_id + 1] - self.post_offsets[term_id]
+
+    def iter_postings(self, term_id):
+        """Yield (chunk_id, positions) for every chunk containing a term."""
+        positions = self.positions
+        pos_offsets = self.pos_offsets
+        for p in range(self.post_offsets[term_id], self.post_offsets[term_id + 1]):
+            yield self.post_chunks[p], positions[pos_offsets[p]:pos_offsets[p + 1]]
+
+    def term_positions(self, term_id, chunk_id):
+        """Return the positions of a term in one chunk, or None if it does not occur there."""
+        lo, hi = self.post_offsets[term_id], self.post_offsets[term_id + 1]
+        chunks = self.post_chunks
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if chunks[mid] < chunk_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.post_offsets[term_id + 1] and chunks[lo] == chunk_id:
+            return self.positions[self.pos_offsets[lo]:self.pos_offsets[lo + 1]]
+        return None
+
+def write_flat_index(path, store, built, meta):
+    """Lay out a ChunkStore and its built index as a flat index file.
+
+    built holds the per-term lists produced by the RAG engine: positional
+    postings, precomputed posting weights, IDF and max scores. Term ids are
+    renumbered in sorted term order so the file supports binary search without
+    an in-memory vocabulary.
+    """
+    postings = built["postings"]
+    weights = built["weights"]
+    order = sorted(range(len(store.terms)), key=lambda t: store.terms[t].encode("utf-8"))
+
+    post_offsets = array('Q', [0])
+    post_chunks = array('I')
+    post_weights = array('f')
+    pos_offsets = array('Q', [0])
+    positions = array('I')
+    for term_id in order:
+        for chunk_id in sorted(postings[term_id]):
+            post_chunks.append(chunk_id)
+            post_weights.append(weights[term_id][chunk_id])
+            positions.extend(postings[term_id][chunk_id])
+            pos_offsets.append(len(positions))
+        post_offsets.append(len(post_chunks))
+
+    text_arena, text_offsets = pack_strings(store.texts)
+    chapter_arena, chapter_offsets = pack_strings(store.chapters)
+    section_arena, section_offsets = pack_strings(store.sections)
+    term_arena, term_offsets = pack_strings(store.terms[t] for t in order)
+
+    write_flat_file(path, {
+        "text_arena": text_arena,
+        "text_offsets": text_offsets,
+        "chapter_arena": chapter_arena,
+        "chapter_offsets": chapter_offsets,
+        "section_arena": section_arena,
+        "section_offsets": section_offsets,
+        "term_arena": term_arena,
+        "term_offsets": term_offsets,
+        "idf": array('d', (built["idf"][t] for t in order)),
+        "max_scores": array('d', (built["max_scores"][t] for t in order)),
+        "doc_lengths": array('I', store.doc_lengths),
+        "has_treatment": bytes(store.has_treatment),
+        "has_diagnosis": bytes(store.has_diagnosis),
+        "post_offsets": post_offsets,
+        "post_chunks": post_chunks,
+        "post_weights": post_weights,
+        "pos_offsets": pos_offsets,
+        "positions": positions,
+    }, meta)
+
+def load_flat_index(path):
+    """Open a flat index file. Returns None if it is missing or unreadable."""
+    if not os.path.exists(path):
+        return None
+    try:
+        meta, arrays = open_flat_file(path)
+        return FlatIndex(meta, arrays)
+    except Exception as e:
+        logger.warning(f"Could not open flat index at {path}: {e}")
+        return None
@@ -0,0 +1,69 @@
+from aho_corasick import AhoCorasick
+from config import CURATED_TOPICS
+from synonyms import expansion_map
+
+# Check for common patterns in medical queries
+TREATMENT_PHRASES = ['treatment for', 'treatment of', 'how to treat', 'medicine for',
+                     'drug for', 'therapy for', 'exact treatment', 'management of']
+DIAGNOSIS_PHRASES = ['diagnosis of', 'symptoms of', 'signs of', 'diagnosing',
+                     'diagnostic criteria', 'what is', 'what diagnosis']
+DOSE_PHRASES = ['dose of', 'dose for', 'dosage of', 'dosage for', 'dosing of', 'dosing for',
+                'how much', 'how many mg', 'how long', 'duration of']
+
+# Phrases used to tell skin ulcers and peptic ulcers apart
+LARGE_CHRONIC_ULCER_PHRASES = ['large chronic ulcers', 'chronic skin ulcers']
+PEPTIC_ULCER_PHRASES = ['peptic ulcer']
+ULCER_PHRASES = ['ulcer']
+
+def _compile_phrases():
+    """Compile every intent and disambiguation phrase into one automaton."""
+    patterns = []
+    for label, phrases in (("treatment", TREATMENT_PHRASES), ("diagnosis", DIAGNOSIS_PHRASES),
+                           ("dose", DOSE_PHRASES), ("large_chronic_ulcer", LARGE_CHRONIC_ULCER_PHRASES),
+                           ("peptic_ulcer", PEPTIC_ULCER_PHRASES), ("ulcer", ULCER_PHRASES)):
+        patterns.extend((phrase, label) for phrase in phrases)
+    return AhoCorasick(patterns)
+
+# Compiled once at import and shared by every request
+phrase_automaton = _compile_phrases()
+topic_automaton = AhoCorasick((topic.lower(), topic) for topic in CURATED_TOPICS)
+
+class QueryAnalysis:
+    """Intent, detected topics and disambiguation flags for one query.
+
+    Built once per request by analyze_query and passed to both retrieval and
+    prompt construction, so neither has to rescan the query.
+    """
+    __slots__ = ("query", "query_lower", "expansions", "search_text", "is_treatment_query", "is_diagnosis_query",
+                 "is_dose_query", "topics", "mentions_ulcer", "contains_large_chronic_ulcers", "contains_peptic_ulcer")
+
+    def __init__(self, query):
+        self.query = query
+        self.query_lower = query.lower()
+        
+        # Abbreviations and spelling variants are expanded once, lexical retrieval scores search_text
+        self.expansions = expansion_map.expand(self.query_lower)
+        self.search_text = " ".join([self.query_lower, *self.expansions])
+
+        labels = {label for _, _, label in phrase_automaton.iter_matches(self.query_lower)}
+        self.is_treatment_query = "treatment" in labels
+        self.is_diagnosis_query = "diagnosis" in labels
+        self.is_dose_query = "dose" in labels
+        self.mentions_ulcer = "ulcer" in labels
+        self.contains_large_chronic_ulcers = "large_chronic_ulcer" in labels
+        self.contains_peptic_ulcer = "peptic_ulcer" in labels
+
+        # Curated topics mentioned as whole words, in order of appearance
+        self.topics = []
+        for _, _, topic in topic_automaton.iter_matches(self.search_text, whole_words=True):
+            if topic not in self.topics:
+                self.topics.append(topic)
+
+    @property
+    def needs_ulcer_disambiguation(self):
+        """True when the query mentions exactly one of the two commonly confused ulcer conditions."""
+        return self.mentions_ulcer and self.contains_large_chronic_ulcers != self.contains_peptic_ulcer
+
+def analyze_query(query):
+    """Analyze a query once: intent, detected curated topics and disambiguation flags."""
+    return QueryAnalysis(query)
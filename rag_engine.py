@@ -1,194 +1,1037 @@
 import os
+import json
+import time
 import logging
+import threading
+import math
 import re
-from document_processor import get_document_content, get_document_sections
-from config import CHUNK_SIZE
+import heapq
+from array import array
+import numpy as np
+from aho_corasick import AhoCorasick
+from document_processor import (PARSER_VERSION, DocumentState, get_document_state, get_document_mtime,
+                                document_changed, load_document, publish_document, get_search_cache_stats)
+from cache import TTLCache
+from context_packer import pack_context, get_packing_stats
+from dosage_index import DosageIndex, MAX_DOSE_ROWS
+from config import (CHUNK_SIZE, CHUNK_OVERLAP, CONTEXT_CACHE_SIZE, CONTEXT_CACHE_TTL, CONTEXT_TOKEN_BUDGET,
+                    CURATED_TOPICS, DOCUMENT_PATH, DOCUMENT_RELOAD_INTERVAL, INDEX_PATH, TOPIC_TABLE_PATH, VECTOR_DB_PATH)
+from flat_index import load_flat_index, write_flat_index
+from query_analysis import analyze_query
+from synonyms import expansion_map
+from snapshot import file_lock
+from spelling import SpellIndex, is_correctable
+from vector_store import fingerprint_chunks, initialize_vector_index, search_dense
 
 logger = logging.getLogger(__name__)
 
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+MIN_CHUNK_SCORE = 1.0  # Threshold to filter out weak matches
+
+# Hybrid retrieval parameters
+RRF_K = 60  # Reciprocal-rank fusion damping constant
+HYBRID_CANDIDATES = 20  # Candidates taken from each ranker before fusion
+MIN_DENSE_SIMILARITY = 0.15  # Cosine similarity below which dense matches are ignored
+DENSE_ONLY_SIMILARITY = 0.35  # Similarity a chunk needs to be relevant without any lexical match
+
+# Bump when curated topics resolve to titles or contexts differently, so stored topic tables are rebuilt
+TOPIC_RESOLVER_VERSION = 2
+
+# Common words that add noise to keyword scoring
+STOP_WORDS = {'and', 'the', 'for', 'with', 'what', 'this', 'that'}
+
+TREATMENT_VOCAB = ['treatment', 'therapy', 'drug', 'medication', 'dose', 'regimen', 'management']
+DIAGNOSIS_VOCAB = ['symptom', 'diagnosis', 'sign', 'diagnostic', 'indication', 'criterion', 'criteria']
+
+class ChunkStore:
+    """Chunk texts plus everything the per-query loop needs, precomputed once at build time.
+    
+    Per-chunk data lives in parallel arrays indexed by chunk id, so scoring a
+    query never has to lowercase or re-scan chunk text. The store is written
+    out as a flat index file, which is what queries actually run against.
+    """
+    __slots__ = ("texts", "chapters", "sections", "token_ids", "doc_lengths",
+                 "has_treatment", "has_diagnosis", "vocab", "terms")
+    
+    def __init__(self, chunks, chapters=None, sections=None):
+        self.texts = list(chunks)
+        self.chapters = list(chapters) if chapters is not None else [None] * len(self.texts)
+        self.sections = list(sections) if sections is not None else [None] * len(self.texts)
+        self.vocab = {}
+        self.terms = []
+        self.token_ids = []
+        self.doc_lengths = array('I')
+        self.has_treatment = bytearray(len(self.texts))
+        self.has_diagnosis = bytearray(len(self.texts))
+        
+        for chunk_id, chunk in enumerate(self.texts):
+            chunk_lower = chunk.lower()
+            ids = array('I')
+            for token in re.findall(r'\b\w+\b', chunk_lower):
+                term_id = self.vocab.get(token)
+                if term_id is None:
+                    term_id = self.vocab[token] = len(self.terms)
+                    self.terms.append(token)
+                ids.append(term_id)
+            self.token_ids.append(ids)
+            self.doc_lengths.append(len(ids))
+            self.has_treatment[chunk_id] = any(word in chunk_lower for word in TREATMENT_VOCAB)
+            self.has_diagnosis[chunk_id] = any(word in chunk_lower for word in DIAGNOSIS_VOCAB)
+    
+    def __len__(self):
+        return len(self.texts)
+
+class RetrievalSnapshot:
+    """Everything retrieval serves for one version of the document, never mutated once built.
+    
+    Requests read the active snapshot once and pass it down, so a reload that
+    swaps in a new snapshot never mixes two document versions in one request.
+    The spelling corrector is the one part filled in later, on first use.
+    """
+    __slots__ = ("index", "vectors", "title_matcher", "spell_index", "sections", "doc_hash", "version", "topic_table",
+                 "dosage_index")
+    
+    def __init__(self, index, vectors, title_matcher, sections, doc_hash, dosage_index=None):
+        self.index = index  # FlatIndex memory-mapped from INDEX_PATH
+        self.vectors = vectors  # Memory-mapped vector index, or None when dense search is unavailable
+        self.title_matcher = title_matcher  # TitleMatcher over the chapter and section titles
+        self.spell_index = None  # Typo corrector over the indexed vocabulary, see speller
+        self.sections = sections
+        self.doc_hash = doc_hash
+        self.version = index.meta["fingerprint"]
+        self.topic_table = {}  # Casefolded curated topic -> precomputed section, chunk ids and packed context
+        self.dosage_index = dosage_index or DosageIndex([])  # Dose rows from the document's tables
+    
+    @property
+    def speller(self):
+        """The SpellIndex over the indexed vocabulary, built the first time a query has an unknown word.
+        
+        Most queries never need it, so workers and corpus shards that only see
+        correctly spelled queries never pay for its deletion dictionary.
+        """
+        if self.spell_index is None:
+            with speller_lock:
+                if self.spell_index is None:
+                    started = time.perf_counter()
+                    self.spell_index = SpellIndex.from_index(self.index)
+                    logger.info(f"Built spelling index over {len(self.spell_index.frequencies)} terms "
+                                f"in {time.perf_counter() - started:.2f}s")
+        return self.spell_index
+
 # Global variables
-document_chunks = []
+active_snapshot = None  # RetrievalSnapshot being served, replaced in one assignment on reload
+snapshot_paths = (INDEX_PATH, VECTOR_DB_PATH, TOPIC_TABLE_PATH)
+reload_lock = threading.Lock()
+speller_lock = threading.Lock()  # Held while a snapshot builds its spelling index
+context_cache = TTLCache(CONTEXT_CACHE_SIZE, CONTEXT_CACHE_TTL)
+
+# How built contexts were produced: retrieved chunks, the section-title fallback, or nothing at all
+context_stats = {"builds": 0, "fallbacks": 0, "no_match": 0}
+context_stats_lock = threading.Lock()
+
+def tokenize(text):
+    """Split text into lowercase word tokens."""
+    return re.findall(r'\b\w+\b', text.lower())
 
-def initialize_rag_engine():
-    """Initialize the RAG engine with document content."""
-    global document_chunks
+def build_chunk_index(store):
+    """Build a positional BM25 inverted index over a ChunkStore.
     
-    try:
-        document_content = get_document_content()
-        if not document_content:
-            logger.error("Document content is empty, cannot create document chunks")
-            return False
+    Postings and IDF are lists indexed by term id. Each posting maps a chunk id
+    to the token positions of the term in that chunk, so the term frequency is
+    the length of the positions array.
+    """
+    postings = [{} for _ in store.terms]
+    
+    for chunk_id, ids in enumerate(store.token_ids):
+        for position, term_id in enumerate(ids):
+            positions = postings[term_id].get(chunk_id)
+            if positions is None:
+                positions = postings[term_id][chunk_id] = array('I')
+            positions.append(position)
+    
+    n_chunks = len(store)
+    idf = [math.log(1 + (n_chunks - len(plist) + 0.5) / (len(plist) + 0.5)) for plist in postings]
+    avgdl = sum(store.doc_lengths) / n_chunks if n_chunks else 0.0
+    
+    # BM25 weight of every posting, and the best contribution of each term as a MaxScore upper bound
+    weights = [
+        {chunk_id: bm25_term_score(idf[term_id], len(positions), store.doc_lengths[chunk_id], avgdl or 1.0)
+         for chunk_id, positions in plist.items()}
+        for term_id, plist in enumerate(postings)
+    ]
+    max_scores = [max(term_weights.values(), default=0.0) for term_weights in weights]
+    
+    return {"postings": postings, "avgdl": avgdl, "idf": idf, "weights": weights, "max_scores": max_scores}
+
+def query_terms(text, snapshot, corrections=None):
+    """Tokenize query text, correcting misspelled words against the snapshot's vocabulary.
+    
+    Words found in the index are looked up in the flat index alone, so the
+    speller is only consulted for unknown ones. Abbreviations and spellings
+    the expansion map knows are left alone; their expansions are searched for
+    them. If corrections is a dict, every rewrite is recorded in it as word -> term.
+    """
+    tokens = tokenize(text)
+    index = snapshot.index
+    if all(not is_correctable(token) or expansion_map.knows(token) or index.term_id(token) is not None
+           for token in tokens):
+        return tokens
+    return snapshot.speller.correct_tokens(tokens, corrections, keep=expansion_map.knows)
+
+def correct_query(query, snapshot=None):
+    """Return (rewritten query, {word: correction}) for the spelling fixes retrieval applies to a query.
+    
+    The rewritten query is the lowercased query with each corrected word
+    replaced, or None when nothing was corrected.
+    """
+    snapshot = snapshot or active_snapshot
+    if snapshot is None:
+        return None, {}
+    
+    corrections = {}
+    query_lower = query.lower()
+    query_terms(query_lower, snapshot, corrections)
+    if not corrections:
+        return None, {}
+    
+    rewritten = re.sub(r'\b\w+\b', lambda match: corrections.get(match.group(0), match.group(0)), query_lower)
+    logger.info(f"Corrected the spelling of '{query}' to '{rewritten}'")
+    return rewritten, corrections
+
+def is_content_word(token):
+    """True for tokens that carry meaning on their own, as opposed to short and common words."""
+    return len(token) > 3 and token not in STOP_WORDS
+
+def extract_keywords(query_tokens):
+    """Keep the distinct query tokens worth scoring on their own."""
+    # Skip common words that add noise
+    return [kw for kw in set(query_tokens) if is_content_word(kw)]
+
+def bm25_term_score(term_idf, tf, doc_length, avgdl):
+    """BM25 contribution of a term that occurs tf times in a chunk of doc_length tokens."""
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_length / avgdl)
+    return term_idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+def match_phrase(term_ids, index):
+    """Return the ids of chunks where the terms occur consecutively, in order.
+    
+    Intersects the positional postings of each term, starting from the rarest,
+    so the cost depends on postings sizes rather than on corpus size.
+    """
+    # Rarest term first keeps the candidate set small
+    offset, anchor = min(enumerate(term_ids), key=lambda x: index.doc_freq(x[1]))
+    matches = []
+    
+    for chunk_id, anchor_positions in index.iter_postings(anchor):
+        starts = {position - offset for position in anchor_positions}
+        for i, term_id in enumerate(term_ids):
+            if i == offset or not starts:
+                continue
+            positions = index.term_positions(term_id, chunk_id)
+            if positions is None:
+                starts = None
+                break
+            starts.intersection_update(position - i for position in positions)
+        if starts:
+            matches.append(chunk_id)
+    
+    return matches
+
+class TitleMatcher:
+    """Chapter and section titles compiled once for single-pass matching against queries.
+    
+    An Aho-Corasick automaton finds every title mentioned in full in the query,
+    and a token -> title map (keyed by title words and their prefixes) scores
+    partial overlaps, so a query is never compared against each title in turn.
+    """
+    __slots__ = ("titles", "lower_titles", "token_map", "automaton")
+    
+    def __init__(self, sections):
+        self.titles = []  # (chapter, section) pairs; section is None for chapter titles
+        self.lower_titles = []
+        self.token_map = {}
+        
+        for chapter_name, chapter_data in sections.items():
+            self._add(chapter_name, None, chapter_name)
+            for section_name in chapter_data["sections"]:
+                self._add(chapter_name, section_name, section_name)
+        
+        self.automaton = AhoCorasick((title, title_id) for title_id, title in enumerate(self.lower_titles))
+    
+    def _add(self, chapter_name, section_name, title):
+        title_id = len(self.titles)
+        self.titles.append((chapter_name, section_name))
+        self.lower_titles.append(title.lower())
+        for word in tokenize(title):
+            # Prefixes let "ulcer" match a title containing "ulcers"
+            for end in range(4, len(word) + 1):
+                self.token_map.setdefault(word[:end], set()).add(title_id)
+    
+    def match(self, query, expansions=()):
+        """Return (title_id, score) pairs for titles matching the query, best first.
+        
+        query is the user's original text, whose capitalisation marks disease
+        names. expansions are extra terms for it, such as spelled-out
+        abbreviations; they count towards title and word matches only.
+        """
+        query_lower = query.lower()
+        expanded = " ".join([query_lower, *expansions])
+        scores = {}
         
-        # Combine content into a single text
-        full_text = "\n".join(document_content)
+        # Titles mentioned in full anywhere in the query or its expansions
+        for _, _, title_id in self.automaton.iter_matches(expanded, whole_words=True):
+            scores[title_id] = scores.get(title_id, 0) + 10
         
-        # Split text into simple chunks
-        chunks = []
-        words = full_text.split()
+        # Check for individual word matches
+        for word in set(tokenize(expanded)):
+            if len(word) > 3:
+                for title_id in self.token_map.get(word, ()):
+                    scores[title_id] = scores.get(title_id, 0) + 1
         
-        # Create simple chunks based on word count (approximating character count)
-        for i in range(0, len(words), CHUNK_SIZE // 5):  # Approximating 5 chars per word
-            chunk = " ".join(words[i:i + CHUNK_SIZE // 5])
-            chunks.append(chunk)
+        # Extract key medical terms that might be mentioned in document headers
+        medical_terms = re.findall(r'\b[A-Z][a-z]{3,}(?:\s+[A-Z][a-z]{3,}){0,3}\b', query)
+        disease_mentions = [term.lower() for term in medical_terms if len(term) > 5]  # Likely disease names are longer
         
-        document_chunks = chunks
-        logger.info(f"Split document into {len(chunks)} chunks")
+        # Whole-query and disease-name checks only need to look at candidate titles
+        for title_id in scores:
+            title_lower = self.lower_titles[title_id]
+            if query_lower in title_lower:
+                scores[title_id] += 10
+            for term in disease_mentions:
+                if term in title_lower:
+                    scores[title_id] += 5
         
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)
+
+def score_phrases(query_tokens, index):
+    """Score every 2-4 word n-gram of the query, overlapping ones included, via the positional index.
+    
+    Only n-grams with at least two content words count: "treatment of" or
+    "is the" occur in most chunks, so bonusing them would outrank the chunks
+    that actually match the query and make every chunk a MaxScore candidate.
+    Returns a dict of chunk id -> phrase bonus.
+    """
+    phrase_scores = {}
+    query_ids = [index.term_id(token) for token in query_tokens]
+    content = [is_content_word(token) for token in query_tokens]
+    for phrase_len in range(2, 5):
+        for start in range(len(query_ids) - phrase_len + 1):
+            phrase_ids = query_ids[start:start + phrase_len]
+            if None in phrase_ids or sum(content[start:start + phrase_len]) < 2:
+                continue
+            for chunk_id in match_phrase(phrase_ids, index):
+                # Higher score for longer phrases and key medical terms
+                phrase_scores[chunk_id] = phrase_scores.get(chunk_id, 0.0) + 3 * phrase_len
+    return phrase_scores
+
+def window_words(words, size, overlap):
+    """Yield overlapping word windows of at most size words."""
+    step = max(size - overlap, 1)
+    for start in range(0, len(words), step):
+        yield words[start:start + size]
+        if start + size >= len(words):
+            break
+
+def chunk_document(content, sections, previous=None):
+    """Split the document into overlapping chunks that never cross a section boundary.
+    
+    Each chunk starts with its chapter or section heading and is tagged with
+    both. Returns a list of (text, chapter, section) tuples. Without any
+    detected chapters the whole content is windowed untagged. With a previous
+    RetrievalSnapshot, sections whose lines did not change keep their old chunks.
+    """
+    size = CHUNK_SIZE // 5  # Approximating 5 chars per word
+    overlap = CHUNK_OVERLAP // 5
+    chunks = []
+    
+    if not sections:
+        for window in window_words("\n".join(content).split(), size, overlap):
+            chunks.append((" ".join(window), None, None))
+        return chunks
+    
+    old_blocks = group_block_texts(previous) if previous else {}
+    rebuilt = 0
+    for chapter_name, chapter_data in sections.items():
+        blocks = [(chapter_name, None, chapter_data["content"])]
+        blocks.extend((section_name, section_name, lines) for section_name, lines in chapter_data["sections"].items())
+        
+        for heading, section_name, lines in blocks:
+            key = (chapter_name, section_name)
+            if key in old_blocks and block_lines(previous.sections, *key) == lines:
+                chunks.extend((text, chapter_name, section_name) for text in old_blocks[key])
+                continue
+            
+            rebuilt += 1
+            words = " ".join(lines).split()
+            for window in window_words(words, size, overlap):
+                chunks.append((f"{heading}\n{' '.join(window)}", chapter_name, section_name))
+    
+    if previous:
+        logger.info(f"Re-chunked {rebuilt} changed sections, reused the rest")
+    return chunks
+
+def block_lines(sections, chapter, section):
+    """Return the lines of one chapter intro or section, or None if it does not exist."""
+    chapter_data = sections.get(chapter)
+    if chapter_data is None:
+        return None
+    return chapter_data["sections"].get(section) if section is not None else chapter_data["content"]
+
+def group_block_texts(snapshot):
+    """Map each (chapter, section) block of a snapshot to its chunk texts in order."""
+    index = snapshot.index
+    blocks = {}
+    for chunk_id in range(len(index)):
+        blocks.setdefault((index.chapters[chunk_id], index.sections[chunk_id]), []).append(index.texts[chunk_id])
+    return blocks
+
+def initialize_rag_engine(index_path=INDEX_PATH, vector_path=VECTOR_DB_PATH, topic_path=TOPIC_TABLE_PATH):
+    """Initialize the RAG engine with document content.
+    
+    index_path, vector_path and topic_path choose where the flat index, vector
+    index and topic table files live, so other corpora can be indexed without
+    touching the default files.
+    """
+    global snapshot_paths
+    
+    try:
+        snapshot_paths = (index_path, vector_path, topic_path)
+        snapshot = build_snapshot(current_document(), snapshot_paths)
+        if snapshot is None:
+            return False
+        
+        activate_snapshot(snapshot)
         return True
     except Exception as e:
         logger.error(f"Error initializing RAG engine: {e}")
         return False
 
-def search_similar_chunks(query, k=5):
-    """Search for chunks similar to the query using enhanced keyword matching."""
-    if not document_chunks:
+def current_document():
+    """The (content, sections, doc_hash, tables) of the document loaded by the document processor."""
+    return get_document_state().astuple()
+
+def build_snapshot(document, paths, previous=None):
+    """Build a RetrievalSnapshot for a loaded document, or None on failure.
+    
+    document is (content, sections, doc_hash, tables) and paths is (index_path,
+    vector_path, topic_path); with topic_path None no topic table is built.
+    The flat index file is reused when it was built from this document with
+    the same chunking. Otherwise the index is rebuilt, reusing the chunks and
+    embeddings of unchanged sections from the previous snapshot if given.
+    Every gunicorn worker calls this on reload, but only one writes the files.
+    """
+    index_path, vector_path, topic_path = paths
+    document_content, sections, doc_hash, tables = document
+    if not document_content:
+        logger.error("Document content is empty, cannot create document chunks")
+        return None
+    
+    # One process at a time builds from these files; the ones that waited find them current and map them
+    with file_lock(index_path):
+        # Map the existing index file when it was built from this document with the same chunking
+        chunk_params = {"chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP, "parser": PARSER_VERSION}
+        index = load_flat_index(index_path)
+        
+        if index and doc_hash and index.meta.get("doc_hash") == doc_hash and index.meta.get("params") == chunk_params:
+            logger.info(f"Memory-mapped retrieval index from {index_path}")
+        else:
+            # Split along the chapter/section structure found by the document processor
+            chunks = chunk_document(document_content, sections, previous)
+            texts = [text for text, _, _ in chunks]
+            
+            store = ChunkStore(texts, [chapter for _, chapter, _ in chunks], [section for _, _, section in chunks])
+            built = build_chunk_index(store)
+            meta = {
+                "doc_hash": doc_hash,
+                "params": chunk_params,
+                "avgdl": built["avgdl"],
+                "fingerprint": fingerprint_chunks(texts),
+            }
+            # The file is replaced by rename, so the previous snapshot keeps its own mapping
+            write_flat_index(index_path, store, built, meta)
+            index = load_flat_index(index_path)
+            if index is None:
+                logger.error("Could not map the retrieval index that was just written")
+                return None
+        
+        logger.info(f"Retrieval index has {len(index)} chunks and {len(index.terms)} distinct terms")
+        
+        # Dense retrieval is optional - lexical search keeps working without it
+        reuse = (previous.index.texts, previous.vectors) if previous and previous.vectors else None
+        vectors = initialize_vector_index(index.texts, vector_path, fingerprint=index.meta["fingerprint"], previous=reuse)
+        if not vectors:
+            logger.warning("Vector index unavailable, dense search mode disabled")
+        
+        dosage_index = DosageIndex.from_tables(tables)
+        logger.info(f"Indexed {len(dosage_index)} dose rows for {len(dosage_index.by_drug)} drugs from {len(tables)} tables")
+        
+        snapshot = RetrievalSnapshot(index, vectors, TitleMatcher(sections), sections, doc_hash, dosage_index)
+        
+        # Curated topic contexts are built last since they run retrieval against the new snapshot
+        if topic_path:
+            snapshot.topic_table = load_topic_table(snapshot, topic_path)
+        return snapshot
+
+def activate_snapshot(snapshot):
+    """Make snapshot the one served to new requests, in a single assignment."""
+    global active_snapshot
+    
+    active_snapshot = snapshot
+    # Entries are keyed by version, clearing just frees the old version's memory
+    context_cache.clear()
+    logger.info(f"RAG engine ready with {len(snapshot.index)} chunks (version {snapshot.version[:12]})")
+
+def reload_document(force=False):
+    """Pick up a new revision of the guidelines document without restarting.
+    
+    Re-parses the document only if its content hash changed (or force is set),
+    rebuilds the index incrementally and swaps it in atomically. Requests
+    already running finish on the snapshot they started with. Returns True if
+    a new snapshot was activated.
+    """
+    with reload_lock:
+        previous = active_snapshot
+        if previous and not force and not document_changed(previous.doc_hash):
+            logger.info("Guidelines document unchanged, nothing to reload")
+            return False
+        
+        started = time.perf_counter()
+        # Parse and index the new revision off to the side; readers keep the old one until both are swapped in
+        document = load_document(DOCUMENT_PATH)
+        if document is None:
+            logger.error("Could not re-read the guidelines document, keeping the current index")
+            return False
+        
+        try:
+            snapshot = build_snapshot(document, snapshot_paths, previous)
+        except Exception as e:
+            logger.error(f"Error rebuilding the RAG engine, keeping the current index: {e}")
+            return False
+        if snapshot is None:
+            return False
+        
+        publish_document(DocumentState(*document))
+        activate_snapshot(snapshot)
+        logger.info(f"Reloaded guidelines document in {time.perf_counter() - started:.2f}s")
+        return True
+
+def start_document_watcher(interval=DOCUMENT_RELOAD_INTERVAL):
+    """Poll the guidelines document's modification time and reload it when it changes.
+    
+    Runs in a daemon thread so every worker process picks up a new revision on
+    its own. Returns the thread, or None when polling is disabled.
+    """
+    if interval <= 0:
+        return None
+    
+    def watch():
+        last_mtime = get_document_mtime()
+        while True:
+            time.sleep(interval)
+            try:
+                mtime = get_document_mtime()
+                if mtime is not None and mtime != last_mtime:
+                    last_mtime = mtime
+                    reload_document()
+            except Exception as e:
+                logger.error(f"Error while checking the guidelines document for changes: {e}")
+    
+    watcher = threading.Thread(target=watch, name="document-watcher", daemon=True)
+    watcher.start()
+    logger.info(f"Watching the guidelines document for changes every {interval}s")
+    return watcher
+
+def rank_lexical(query, k=5, analysis=None, snapshot=None):
+    """Rank chunks for the query with BM25, phrase bonuses and intent boosts.
+    
+    Returns a list of (chunk_id, score) pairs, best first. snapshot defaults to
+    the active one, as in every ranking function below.
+    """
+    analysis = analysis or analyze_query(query)
+    is_treatment_query = analysis.is_treatment_query
+    is_diagnosis_query = analysis.is_diagnosis_query
+    
+    # Extract keywords - give more importance to multi-word phrases
+    snapshot = snapshot or active_snapshot
+    query_tokens = query_terms(analysis.search_text, snapshot)
+    keywords = extract_keywords(query_tokens)
+    
+    index = snapshot.index
+    idf = index.idf
+    doc_lengths = index.doc_lengths
+    pos_offsets = index.pos_offsets
+    post_chunks = index.post_chunks
+    avgdl = index.avgdl or 1.0
+    if k <= 0:
+        return []
+    
+    # Query terms ordered by the most they can add to any chunk, lowest first
+    terms = sorted(
+        (index.max_scores[term_id], term_id)
+        for term_id in (index.term_id(keyword) for keyword in keywords)
+        if term_id is not None
+    )
+    bounds = [0.0]  # bounds[i] is the combined upper bound of terms[:i]
+    for upper, _ in terms:
+        bounds.append(bounds[-1] + upper)
+    
+    phrase_scores = score_phrases(query_tokens, index)
+    phrase_chunks = sorted(phrase_scores)
+    
+    # Boost score for chunks containing treatment/diagnosis info in treatment/diagnosis queries
+    max_boost = (1.5 if is_treatment_query else 1.0) * (1.5 if is_diagnosis_query else 1.0)
+    
+    def split(threshold):
+        """Number of leading terms that cannot lift a chunk past threshold on their own."""
+        n = 0
+        while n < len(terms) and bounds[n + 1] * max_boost <= threshold:
+            n += 1
+        return n
+    
+    # MaxScore: only postings of "essential" terms (and phrase matches) produce candidates.
+    # The threshold is the k-th best score so far, starting at the minimum meaningful score.
+    heap = []
+    threshold = MIN_CHUNK_SCORE
+    n_nonessential = split(threshold)
+    cursors = [index.post_offsets[term_id] for _, term_id in terms]
+    ends = [index.post_offsets[term_id + 1] for _, term_id in terms]
+    phrase_cursor = 0
+    
+    while True:
+        # Next candidate is the smallest chunk id under any essential cursor or phrase match
+        chunk_id = phrase_chunks[phrase_cursor] if phrase_cursor < len(phrase_chunks) else None
+        for i in range(n_nonessential, len(terms)):
+            if cursors[i] < ends[i] and (chunk_id is None or post_chunks[cursors[i]] < chunk_id):
+                chunk_id = post_chunks[cursors[i]]
+        if chunk_id is None:
+            break
+        if phrase_cursor < len(phrase_chunks) and phrase_chunks[phrase_cursor] == chunk_id:
+            phrase_cursor += 1
+        
+        chunk_boost = 1.0
+        if is_treatment_query and index.has_treatment[chunk_id]:
+            chunk_boost *= 1.5
+        if is_diagnosis_query and index.has_diagnosis[chunk_id]:
+            chunk_boost *= 1.5
+        
+        score = phrase_scores.get(chunk_id, 0.0)
+        for i in range(n_nonessential, len(terms)):
+            p = cursors[i]
+            if p < ends[i] and post_chunks[p] == chunk_id:
+                score += bm25_term_score(idf[terms[i][1]], pos_offsets[p + 1] - pos_offsets[p], doc_lengths[chunk_id], avgdl)
+                cursors[i] = p + 1
+        
+        # Non-essential terms, largest bound first, stopping as soon as the chunk cannot make the cut
+        for i in range(n_nonessential - 1, -1, -1):
+            if (score + bounds[i + 1]) * chunk_boost <= threshold:
+                break
+            positions = index.term_positions(terms[i][1], chunk_id)
+            if positions is not None:
+                score += bm25_term_score(idf[terms[i][1]], len(positions), doc_lengths[chunk_id], avgdl)
+        
+        score *= chunk_boost
+        
+        # Only include chunks with meaningful score
+        if score > threshold:
+            if len(heap) < k:
+                heapq.heappush(heap, (score, chunk_id))
+            else:
+                heapq.heapreplace(heap, (score, chunk_id))
+            if len(heap) == k:
+                threshold = max(threshold, heap[0][0])
+                n_nonessential = split(threshold)
+    
+    return [(chunk_id, score) for score, chunk_id in sorted(heap, reverse=True)]
+
+def rank_dense(query, k=5, snapshot=None):
+    """Rank chunks by embedding similarity, dropping near-orthogonal matches."""
+    snapshot = snapshot or active_snapshot
+    if not snapshot.vectors:
+        return []
+    
+    corrected = " ".join(query_terms(query.lower(), snapshot))
+    return [(chunk_id, score) for chunk_id, score in search_dense(corrected, k, snapshot.vectors)
+            if score >= MIN_DENSE_SIMILARITY]
+
+def rank_hybrid(query, k=5, analysis=None, snapshot=None):
+    """Fuse the lexical and dense rankings with reciprocal-rank fusion.
+    
+    Hashed n-gram vectors give most real-word queries some similarity to some
+    chunk, so a chunk only counts as relevant with a lexical match or a much
+    stronger dense one. That leaves unrelated queries with no results, and
+    callers can fall back to section titles or say the guide has nothing.
+    """
+    snapshot = snapshot or active_snapshot
+    lexical = rank_lexical(query, HYBRID_CANDIDATES, analysis, snapshot)
+    dense = rank_dense(query, HYBRID_CANDIDATES, snapshot)
+    relevant = {chunk_id for chunk_id, _ in lexical}
+    relevant.update(chunk_id for chunk_id, score in dense if score >= DENSE_ONLY_SIMILARITY)
+    
+    fused = {}
+    for ranking in (lexical, dense):
+        for rank, (chunk_id, _) in enumerate(ranking, start=1):
+            if chunk_id in relevant:
+                fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank)
+    
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)[:k]
+
+def search_similar_chunks(query, k=5, mode="lexical", analysis=None, snapshot=None):
+    """Search for chunks similar to the query.
+    
+    mode is "lexical" (BM25 over the inverted index), "dense" (memory-mapped
+    chunk embeddings) or "hybrid" (both, fused with reciprocal-rank fusion).
+    analysis is an optional QueryAnalysis already computed for this query.
+    """
+    snapshot = snapshot or active_snapshot
+    if not snapshot:
         logger.error("Document chunks not initialized")
         return []
     
     try:
-        # Preprocess query to extract important terms
-        query_lower = query.lower()
+        if mode == "dense":
+            ranked = rank_dense(query, k, snapshot)
+        elif mode == "hybrid":
+            ranked = rank_hybrid(query, k, analysis, snapshot)
+        else:
+            ranked = rank_lexical(query, k, analysis, snapshot)
         
-        # Check for common patterns in medical queries
-        treatment_phrases = ['treatment for', 'treatment of', 'how to treat', 'medicine for', 'drug for', 'therapy for', 'exact treatment']
-        diagnosis_phrases = ['diagnosis of', 'symptoms of', 'signs of', 'diagnosing', 'diagnostic criteria', 'what is', 'what diagnosis']
+        return [{"content": snapshot.index.texts[chunk_id], "score": score, "chunk_id": chunk_id}
+                for chunk_id, score in ranked]
+    except Exception as e:
+        logger.error(f"Error searching document chunks: {e}")
+        return []
+
+def search_many(queries, k=5):
+    """Score many queries against the index in one vectorized pass.
+    
+    Builds a sparse query x term matrix and multiplies it with the term x chunk
+    CSR matrix of precomputed BM25 weights stored in the flat index. Phrase
+    bonuses and intent boosts are applied as in search_similar_chunks. Returns
+    one list of {"content", "score"} dicts per query, in input order.
+    """
+    snapshot = active_snapshot
+    if not snapshot:
+        logger.error("Document chunks not initialized")
+        return [[] for _ in queries]
+    if not queries or k <= 0:
+        return [[] for _ in queries]
+    
+    try:
+        index = snapshot.index
+        n_chunks = len(index)
+        post_offsets = np.frombuffer(index.post_offsets, dtype=np.uint64).astype(np.int64)
+        post_chunks = np.frombuffer(index.post_chunks, dtype=np.uint32)
+        post_weights = np.frombuffer(index.post_weights, dtype=np.float32)
+        has_treatment = np.frombuffer(index.has_treatment, dtype=np.uint8).astype(bool)
+        has_diagnosis = np.frombuffer(index.has_diagnosis, dtype=np.uint8).astype(bool)
         
-        is_treatment_query = any(phrase in query_lower for phrase in treatment_phrases)
-        is_diagnosis_query = any(phrase in query_lower for phrase in diagnosis_phrases)
+        # Sparse query x term matrix in coordinate form (every keyword has weight 1)
+        analyses = [analyze_query(query) for query in queries]
+        query_tokens = [query_terms(analysis.search_text, snapshot) for analysis in analyses]
+        rows, cols = [], []
+        for row, tokens in enumerate(query_tokens):
+            for keyword in extract_keywords(tokens):
+                term_id = index.term_id(keyword)
+                if term_id is not None:
+                    rows.append(row)
+                    cols.append(term_id)
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
         
-        # Extract keywords - give more importance to multi-word phrases
-        keywords = re.findall(r'\b\w+\b', query_lower)
-        phrases = re.findall(r'\b\w+(?:\s+\w+){1,3}\b', query_lower)  # Match 2-4 word phrases
+        # Gather every posting of every (query, term) pair in one ragged range expansion
+        starts = post_offsets[cols]
+        lengths = post_offsets[cols + 1] - starts
+        total = int(lengths.sum())
+        posting_ids = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        flat_cells = np.repeat(rows, lengths) * n_chunks + post_chunks[posting_ids]
+        scores = np.bincount(flat_cells, weights=post_weights[posting_ids], minlength=len(queries) * n_chunks)
+        scores = scores.reshape(len(queries), n_chunks)
         
-        # Score chunks based on keyword and phrase matches with enhanced weighting
-        chunk_scores = []
-        for chunk in document_chunks:
-            chunk_lower = chunk.lower()
-            score = 0
-            
-            # Score individual keywords
-            for keyword in keywords:
-                if keyword in chunk_lower:
-                    # Skip common words that add noise
-                    if len(keyword) <= 3 or keyword in ['and', 'the', 'for', 'with', 'what', 'this', 'that']:
-                        continue
-                    
-                    # Higher score for exact matches (with word boundaries)
-                    if re.search(r'\b' + re.escape(keyword) + r'\b', chunk_lower):
-                        score += 2
-                    else:
-                        score += 1
-            
-            # Score multi-word phrases - these get higher weights
-            for phrase in phrases:
-                if phrase in chunk_lower:
-                    # Higher score for longer phrases and key medical terms
-                    phrase_len = len(phrase.split())
-                    score += 3 * phrase_len
-            
-            # Boost score for chunks containing treatment info in treatment queries
-            if is_treatment_query and any(word in chunk_lower for word in ['treatment', 'therapy', 'drug', 'medication', 'dose', 'regimen', 'management']):
-                score *= 1.5
-            
-            # Boost score for chunks containing diagnosis info in diagnosis queries
-            if is_diagnosis_query and any(word in chunk_lower for word in ['symptom', 'diagnosis', 'sign', 'diagnostic', 'indication', 'criterion', 'criteria']):
-                score *= 1.5
-            
-            # Only include chunks with meaningful score
-            if score > 2:  # Threshold to filter out weak matches
-                chunk_scores.append({"content": chunk, "score": score})
+        for row, (analysis, tokens) in enumerate(zip(analyses, query_tokens)):
+            for chunk_id, bonus in score_phrases(tokens, index).items():
+                scores[row, chunk_id] += bonus
+            if analysis.is_treatment_query:
+                scores[row, has_treatment] *= 1.5
+            if analysis.is_diagnosis_query:
+                scores[row, has_diagnosis] *= 1.5
         
-        # Sort by score and return top k
-        sorted_chunks = sorted(chunk_scores, key=lambda x: x["score"], reverse=True)
-        return sorted_chunks[:k]
+        # Per-query top k by partial selection, then drop weak matches
+        k = min(k, n_chunks)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row in range(len(queries)):
+            row_top = top[row][np.argsort(-scores[row, top[row]])]
+            results.append([
+                {"content": index.texts[int(chunk_id)], "score": float(scores[row, chunk_id])}
+                for chunk_id in row_top if scores[row, chunk_id] > MIN_CHUNK_SCORE
+            ])
+        return results
     except Exception as e:
-        logger.error(f"Error searching document chunks: {e}")
+        logger.error(f"Error in batch chunk search: {e}")
+        return [[] for _ in queries]
+
+def search_section_titles(query, snapshot=None, expansions=()):
+    """Find the chapters and sections whose titles best match the query.
+    
+    expansions are the query's expansion terms, see TitleMatcher.match.
+    Returns (content, score) pairs, best first.
+    """
+    snapshot = snapshot or active_snapshot
+    if snapshot is None:
         return []
+    
+    relevant_sections = []
+    for title_id, score in snapshot.title_matcher.match(query, expansions):
+        chapter_name, section_name = snapshot.title_matcher.titles[title_id]
+        lines = block_lines(snapshot.sections, chapter_name, section_name) or []
+        relevant_sections.append(("\n".join(lines), score))
+    return relevant_sections
 
-def generate_context_for_query(query):
-    """Generate a context for the given query by combining relevant chunks and structure the information."""
-    # Increase result count to get more potentially relevant chunks
-    chunks = search_similar_chunks(query, k=5)
+def title_covers_topic(title, topic):
+    """True if a title names the whole topic: it contains the topic, or its words cover every content word of it.
+    
+    Words match exactly or as prefixes of at least four letters, so "Ulcers"
+    covers "ulcer", but the "Infections" chapter does not cover "Herpes
+    Zoster Infections".
+    """
+    title_lower = title.lower()
+    topic_lower = topic.lower()
+    if topic_lower in title_lower:
+        return True
+    
+    title_words = tokenize(title_lower)
+    topic_words = [word for word in tokenize(topic_lower) if is_content_word(word)]
+    
+    def covered(word):
+        for title_word in title_words:
+            shorter, longer = sorted((word, title_word), key=len)
+            if shorter == longer or (len(shorter) >= 4 and longer.startswith(shorter)):
+                return True
+        return False
     
-    # Extract key medical terms that might be mentioned in document headers
-    medical_terms = re.findall(r'\b[A-Z][a-z]{3,}(?:\s+[A-Z][a-z]{3,}){0,3}\b', query)
-    disease_mentions = [term for term in medical_terms if len(term) > 5]  # Likely disease names are longer
+    return bool(topic_words) and all(covered(word) for word in topic_words)
+
+def find_section_for_topic(topic, snapshot=None):
+    """Return the (chapter, section) whose title best matches a topic, or None.
     
-    if not chunks or len(''.join([chunk["content"] for chunk in chunks])) < 200:  # If content is too short
-        # Enhanced fallback to section-based search 
+    section is None when the best match is a chapter title. Titles that share
+    only some words with the topic are not accepted, see title_covers_topic.
+    """
+    snapshot = snapshot or active_snapshot
+    matcher = snapshot.title_matcher if snapshot else None
+    for title_id, _ in matcher.match(topic) if matcher else []:
+        chapter, section = matcher.titles[title_id]
+        if title_covers_topic(section or chapter, topic):
+            return chapter, section
+    return None
+
+def normalize_query(query):
+    """Normalize a query for use as a cache key."""
+    return " ".join(query.split()).casefold()
+
+def get_context_cache_stats():
+    """Get hit/miss counters for the query context cache."""
+    return context_cache.stats()
+
+def generate_context_for_query(query, analysis=None):
+    """Generate a context for the given query, served from the context cache when possible."""
+    snapshot = active_snapshot
+    key = (normalize_query(query), snapshot.version if snapshot else None)
+    context = context_cache.get(key)
+    if context is None:
+        context = build_context_for_query(query, analysis, snapshot)
+        context_cache.set(key, context)
+    return context
+
+def build_context_for_query(query, analysis=None, snapshot=None):
+    """Generate a context for the given query by combining relevant chunks and structure the information.
+    
+    The passages are packed into the configured token budget, best first with near-duplicates dropped.
+    """
+    return build_context_with_chunks(query, analysis, snapshot)[0]
+
+def build_context_with_chunks(query, analysis=None, snapshot=None):
+    """Like build_context_for_query, but return (context, chunk ids) with the ids of the retrieved chunks.
+    
+    The ids come from the same ranking as the context, and are empty when it
+    was built from the section-title fallback or nothing matched.
+    """
+    # One fused lexical + dense lookup covers both exact terms and loose wording
+    analysis = analysis or analyze_query(query)
+    chunks = search_similar_chunks(query, k=5, mode="hybrid", analysis=analysis, snapshot=snapshot)
+    count_context_build(fallback=not chunks)
+    
+    if not chunks:
+        # Section title matching is only needed when neither ranker found anything
         try:
-            sections = get_document_sections()
-            relevant_sections = []
-            
-            # Check for disease/treatment terms in chapter and section names
-            for chapter_name, chapter_data in sections.items():
-                # More sophisticated chapter name matching
-                chapter_match_score = 0
-                
-                # Check for whole query matches
-                if query.lower() in chapter_name.lower():
-                    chapter_match_score += 10
-                
-                # Check for disease name matches in chapter titles
-                for term in disease_mentions:
-                    if term.lower() in chapter_name.lower():
-                        chapter_match_score += 5
-                
-                # Check for individual word matches
-                for word in query.lower().split():
-                    if len(word) > 3 and word in chapter_name.lower():
-                        chapter_match_score += 1
-                
-                if chapter_match_score > 0:
-                    relevant_sections.append(("\n".join(chapter_data["content"]), chapter_match_score))
-                
-                # Search section names similarly
-                for section_name, section_content in chapter_data["sections"].items():
-                    section_match_score = 0
-                    
-                    if query.lower() in section_name.lower():
-                        section_match_score += 10
-                    
-                    for term in disease_mentions:
-                        if term.lower() in section_name.lower():
-                            section_match_score += 5
-                    
-                    for word in query.lower().split():
-                        if len(word) > 3 and word in section_name.lower():
-                            section_match_score += 1
-                    
-                    if section_match_score > 0:
-                        relevant_sections.append(("\n".join(section_content), section_match_score))
-            
+            relevant_sections = search_section_titles(query, snapshot, analysis.expansions)
             if relevant_sections:
-                # Sort by relevance score
-                relevant_sections.sort(key=lambda x: x[1], reverse=True)
-                # Take top 3 most relevant sections
-                top_sections = [section[0] for section in relevant_sections[:3]]
-                return "\n\n".join(top_sections)
+                # Take top 3 most relevant sections, trimmed to the budget
+                context, report = pack_context(relevant_sections[:3])
+                log_packing(query, report)
+                return context, []
         except Exception as e:
             logger.error(f"Error in fallback section search: {e}")
         
-        return "The guidelines do not appear to contain specific information about this query."
+        count_context_build(no_match=True)
+        return "The guidelines do not appear to contain specific information about this query.", []
     
     # Structure the context with any section/chapter headings when available
-    structured_context = []
+    structured_context = [(format_chunk(chunk["content"]), chunk["score"]) for chunk in chunks]
+    
+    # Combine chunks into a well-structured context within the token budget
+    context, report = pack_context(structured_context)
+    log_packing(query, report)
+    return context, [chunk["chunk_id"] for chunk in chunks]
+
+def count_context_build(fallback=False, no_match=False):
+    """Record one context build, or that a fallback build found nothing either."""
+    with context_stats_lock:
+        if no_match:
+            context_stats["no_match"] += 1
+            return
+        context_stats["builds"] += 1
+        if fallback:
+            context_stats["fallbacks"] += 1
+
+def get_retrieval_stats():
+    """Get cache, packing, query expansion and fallback-path statistics for this worker."""
+    with context_stats_lock:
+        builds = dict(context_stats)
+    total = builds["builds"]
+    builds["fallback_rate"] = builds["fallbacks"] / total if total else 0.0
+    builds["no_match_rate"] = builds["no_match"] / total if total else 0.0
+    
+    return {
+        "context_cache": get_context_cache_stats(),
+        "search_cache": get_search_cache_stats(),
+        "context_packing": get_packing_stats(),
+        "query_expansion": expansion_map.stats(),
+        "context_builds": builds,
+        "spelling": get_spelling_stats(),
+    }
+
+def get_spelling_stats(snapshot=None):
+    """Get the size of the active snapshot's spelling index, or {"built": False} before its first use."""
+    snapshot = snapshot or active_snapshot
+    speller = snapshot.spell_index if snapshot else None
+    if speller is None:
+        return {"built": False}
+    return {"built": True, **speller.stats()}
+
+def format_chunk(content):
+    """Format a chunk for a prompt, setting its heading line apart when it has one."""
+    # Try to identify if this chunk has a heading/title line
+    lines = content.split('\n')
+    
+    if len(lines) > 1 and len(lines[0]) < 100 and any(char.isupper() for char in lines[0]):
+        # Likely a heading - format it more prominently
+        heading = lines[0].strip()
+        content_body = '\n'.join(lines[1:]).strip()
+        return f"## {heading} ##\n{content_body}"
+    return content
+
+def log_packing(query, report):
+    """Log how many prompt tokens packing saved for one query."""
+    logger.info(f"Packed context for '{query[:50]}': {report['tokens_out']}/{report['tokens_in']} tokens, "
+                f"saved {report['tokens_saved']} ({report['duplicates_dropped']} duplicates dropped, "
+                f"{report['passages_trimmed']} trimmed)")
+
+def group_chunks_by_title(index):
+    """Map (chapter, section) and (chapter, None) to the ids of the chunks under that title."""
+    groups = {}
+    for chunk_id in range(len(index)):
+        chapter, section = index.chapters[chunk_id], index.sections[chunk_id]
+        # A chapter title covers every chunk in the chapter
+        groups.setdefault((chapter, None), []).append(chunk_id)
+        if section is not None:
+            groups.setdefault((chapter, section), []).append(chunk_id)
+    return groups
+
+def build_topic_entry(topic, chunks_by_title, snapshot):
+    """Resolve a curated topic to its guide section, chunk ids and packed context."""
+    index = snapshot.index
+    match = find_section_for_topic(topic, snapshot)
+    chapter, section = match if match else (None, None)
+    chunk_ids = chunks_by_title.get(match, []) if match else []
+    
+    if chunk_ids:
+        # Keep document order by scoring earlier chunks higher
+        passages = [(format_chunk(index.texts[chunk_id]), len(chunk_ids) - rank)
+                    for rank, chunk_id in enumerate(chunk_ids)]
+        context, _ = pack_context(passages)
+    else:
+        # No title names the topic, fall back to what retrieval finds for the topic name
+        context, chunk_ids = build_context_with_chunks(topic, snapshot=snapshot)
     
-    for chunk in chunks:
-        content = chunk["content"]
-        # Try to identify if this chunk has a heading/title line
-        lines = content.split('\n')
+    return {"topic": topic, "chapter": chapter, "section": section, "chunk_ids": chunk_ids, "context": context}
+
+def load_topic_table(snapshot, path=TOPIC_TABLE_PATH):
+    """Load the curated topic table for a snapshot from path, or build and persist it when stale.
+    
+    Returns the table, which is empty if it could not be built.
+    """
+    key = {"version": snapshot.version, "budget": CONTEXT_TOKEN_BUDGET, "topics": CURATED_TOPICS,
+           "resolver": TOPIC_RESOLVER_VERSION}
+    try:
+        if os.path.exists(path):
+            with open(path) as f:
+                stored = json.load(f)
+            if stored.get("key") == key:
+                logger.info(f"Loaded {len(stored['entries'])} precomputed topic contexts from {path}")
+                return {entry["topic"].casefold(): entry for entry in stored["entries"]}
+    except Exception as e:
+        logger.warning(f"Could not read topic table at {path}: {e}")
+    
+    try:
+        chunks_by_title = group_chunks_by_title(snapshot.index)
+        entries = [build_topic_entry(topic, chunks_by_title, snapshot) for topic in CURATED_TOPICS]
         
-        if len(lines) > 1 and len(lines[0]) < 100 and any(char.isupper() for char in lines[0]):
-            # Likely a heading - format it more prominently
-            heading = lines[0].strip()
-            content_body = '\n'.join(lines[1:]).strip()
-            
-            structured_chunk = f"## {heading} ##\n{content_body}"
-            structured_context.append(structured_chunk)
-        else:
-            structured_context.append(content)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"key": key, "entries": entries}, f)
+        os.replace(tmp_path, path)
+        
+        resolved = sum(1 for entry in entries if entry["chapter"])
+        logger.info(f"Built topic table for {len(entries)} topics ({resolved} matched a guide section) at {path}")
+        return {entry["topic"].casefold(): entry for entry in entries}
+    except Exception as e:
+        logger.error(f"Error building topic table: {e}")
+        return {}
+
+def get_topic_context(topic):
+    """Return the precomputed context for a curated topic, or None if it is not in the table."""
+    snapshot = active_snapshot
+    entry = snapshot.topic_table.get(topic.casefold()) if snapshot else None
+    return entry["context"] if entry else None
+
+def lookup_doses(drug=None, condition=None, snapshot=None):
+    """Return the dose rows for a drug and/or condition from the document's tables, as dictionaries."""
+    snapshot = snapshot or active_snapshot
+    if snapshot is None:
+        return []
+    return [row.to_dict() for row in snapshot.dosage_index.lookup(drug, condition)]
+
+def find_dose_rows(query, analysis=None, snapshot=None, limit=MAX_DOSE_ROWS):
+    """Return (DoseRows, drug names) for a free-text question, matched on its expanded search text.
     
-    # Combine chunks into a well-structured context
-    context = "\n\n".join(structured_context)
-    return context
+    The drug names are the indexed drugs the question mentions, empty when it
+    only names a condition.
+    """
+    snapshot = snapshot or active_snapshot
+    if snapshot is None:
+        return [], []
+    analysis = analysis or analyze_query(query)
+    dosage_index = snapshot.dosage_index
+    return dosage_index.rows_for_query(analysis.search_text, limit), dosage_index.match(analysis.search_text)[0]
+
+def dose_rows_answer_query(dose_rows, query, analysis=None, snapshot=None):
+    """True if dose rows from find_dose_rows cover every condition and patient group the question names."""
+    snapshot = snapshot or active_snapshot
+    if snapshot is None or not dose_rows:
+        return False
+    analysis = analysis or analyze_query(query)
+    return snapshot.dosage_index.covers_query(analysis.search_text, dose_rows, analysis.topics)
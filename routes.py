@@ -1,3 +1,4 @@
+import hmac
 import json
 import logging
 import re
@@ -11,8 +12,10 @@ from models import (
     ChallengeAttempt, Flashcard, FlashcardProgress, 
     Achievement, UserAchievement
 )
-from document_processor import search_document
-from rag_engine import search_similar_chunks
+from document_processor import search_document_page
+from rag_engine import (search_similar_chunks, search_many, reload_document, get_retrieval_stats,
+                        lookup_doses, find_dose_rows, correct_query)
+from corpus import search_corpus, get_corpus_documents, get_shard_stats
 from ai_service import (
     get_diagnosis_response, generate_case_simulation, 
     generate_daily_challenge, generate_multiple_daily_challenges,
@@ -24,7 +27,8 @@ from gamification import (
 )
 from config import (
     CASE_COMPLETION_POINTS, CHALLENGE_COMPLETION_POINTS,
-    CORRECT_DIAGNOSIS_BONUS, FLASHCARD_REVIEW_POINTS
+    CORRECT_DIAGNOSIS_BONUS, FLASHCARD_REVIEW_POINTS, CURATED_TOPICS,
+    SEARCH_BATCH_LIMIT, SEARCH_PAGE_SIZE, SEARCH_PAGE_LIMIT, SHARD_SEARCH_LIMIT, ADMIN_API_KEY
 )
 from auth import auth_bp
 
@@ -39,6 +43,16 @@ with app.app_context():
 
 # We'll use Flask-Login's built-in login_required decorator
 
+def admin_key_required(f):
+    """Require the X-Admin-Key header to match ADMIN_API_KEY (admin endpoints are off without one)."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        provided_key = request.headers.get('X-Admin-Key', '')
+        if not ADMIN_API_KEY or not hmac.compare_digest(provided_key, ADMIN_API_KEY):
+            return jsonify({"error": "Unauthorized"}), 403
+        return f(*args, **kwargs)
+    return decorated
+
 @app.route('/')
 def index():
     """Render the main page."""
@@ -109,7 +123,9 @@ def api_chat():
             db.session.add(chat_history)
             db.session.commit()
         
-        return jsonify({"response": response})
+        # Tell the user which misspelled words the guide was searched with instead
+        corrected_query, _ = correct_query(query)
+        return jsonify({"response": response, "corrected_query": corrected_query})
     except Exception as e:
         logger.error(f"Error in chat API: {e}")
         return jsonify({"error": "An error occurred processing your request"}), 500
@@ -124,36 +140,16 @@ def api_new_simulation():
         logger.info("Requesting new case simulation from knowledge base")
         
         # Get all available topics
-        topics = [
-            "Diarrhoea", "Rotavirus Disease and Diarrhoea", "Constipation", "Peptic Ulcer Disease",
-            "Gastro-oesophageal Reflux Disease", "Haemorrhoids", "Vomiting", "Anaemia", "Measles",
-            "Pertussis", "Common cold", "Pneumonia", "Headache", "Boils", "Impetigo", "Buruli ulcer",
-            "Yaws", "Superficial Fungal Skin infections", "Pityriasis Versicolor", "Herpes Simplex Infections",
-            "Herpes Zoster Infections", "Chicken pox", "Large Chronic Ulcers", "Pruritus", "Urticaria",
-            "Reactive Erythema and Bullous Reaction", "Acne Vulgaris", "Eczema", "Intertrigo", "Diabetes Mellitus",
-            "Diabetic Ketoacidosis", "Diabetes in Pregnancy", "Treatment-Induced Hypoglycemia", "Dyslipidaemia",
-            "Goitre", "Hypothyroidism", "Hyperthyroidism", "Overweight and Obesity", "Dysmenorrhoea",
-            "Abortion", "Abnormal Vaginal Bleeding", "Abnormal Vaginal Discharge", "Acute Lower Abdominal Pain",
-            "Menopause", "Erectile Dysfunction", "Urinary Tract Infection", "Sexually Transmitted Infections in Adults",
-            "Fever", "Tuberculosis", "Typhoid fever", "Malaria", "Uncomplicated Malaria", "Severe Malaria",
-            "Malaria in Pregnancy", "Worm Infestation", "Xerophthalmia", "Foreign body in the eye",
-            "Neonatal conjunctivitis", "Red eye", "Stridor", "Acute Epiglottitis", "Retropharyngeal Abscess",
-            "Pharyngitis and Tonsillitis", "Acute Sinusitis", "Acute otitis Media", "Chronic Otitis Media",
-            "Epistaxis", "Dental Caries", "Oral Candidiasis", "Acute Necrotizing Ulcerative Gingivitis",
-            "Acute Bacterial Sialoadenitis", "Chronic Periodontal Infections", "Mouth Ulcers", "Odontogenic Infections",
-            "Osteoarthritis", "Rheumatoid arthritis", "Juvenile Idiopathic Arthritis", "Back pain", "Gout",
-            "Dislocations", "Open Fractures", "Cellulitis", "Burns", "Wounds", "Bites and Stings",
-            "Shock", "Acute Allergic Reaction"
-        ]
+        topics = CURATED_TOPICS
         
         # Randomly select a topic
         from random import choice
         selected_topic = choice(topics)
         logger.info(f"Selected topic for case simulation: {selected_topic}")
         
-        # Use the RAG engine to get information about this topic from the knowledge base
-        from rag_engine import generate_context_for_query
-        topic_info = generate_context_for_query(selected_topic)
+        # Read the precomputed knowledge base context for this topic
+        from rag_engine import get_topic_context, generate_context_for_query
+        topic_info = get_topic_context(selected_topic) or generate_context_for_query(selected_topic)
         
         # Create a presenting complaint based on the topic
         # For this simpler version, we'll use a more straightforward case template
@@ -1276,18 +1272,149 @@ def api_user_stats():
 
 @app.route('/api/search', methods=['POST'])
 def api_search():
-    """API endpoint to search the document."""
+    """API endpoint to search the document, one page of highlighted results at a time."""
     try:
-        data = request.json
+        data = request.json or {}
         query = data.get('query', '')
+        limit = data.get('limit', SEARCH_PAGE_SIZE)
+        cursor = data.get('cursor')
         
         if not query:
             return jsonify({"error": "Query is required"}), 400
         
-        # Search document
-        search_results = search_document(query)
+        if isinstance(limit, bool) or not isinstance(limit, int) or not 1 <= limit <= SEARCH_PAGE_LIMIT:
+            return jsonify({"error": f"limit must be an integer between 1 and {SEARCH_PAGE_LIMIT}"}), 400
         
-        return jsonify({"results": search_results})
+        # The ranked hits are cached, so following next_cursor only slices out the next page
+        try:
+            page = search_document_page(query, limit=limit, cursor=cursor)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        return jsonify(page)
     except Exception as e:
         logger.error(f"Error in search API: {e}")
         return jsonify({"error": "An error occurred during search"}), 500
+
+@app.route('/api/search/batch', methods=['POST'])
+def api_search_batch():
+    """API endpoint to retrieve guideline chunks for many queries at once."""
+    try:
+        data = request.json or {}
+        queries = data.get('queries', [])
+        k = data.get('k', 5)
+        
+        if not isinstance(queries, list) or not queries or not all(isinstance(q, str) for q in queries):
+            return jsonify({"error": "A non-empty list of query strings is required"}), 400
+        
+        if len(queries) > SEARCH_BATCH_LIMIT:
+            return jsonify({"error": f"At most {SEARCH_BATCH_LIMIT} queries are allowed per request"}), 400
+        
+        if isinstance(k, bool) or not isinstance(k, int) or k < 1:
+            return jsonify({"error": "k must be a positive integer"}), 400
+        
+        # Score all queries in one pass over the index
+        batch_results = search_many(queries, k=k)
+        
+        results = []
+        for query, chunks in zip(queries, batch_results):
+            # Misspelled words are searched as their unique closest vocabulary term
+            corrected_query, corrections = correct_query(query)
+            results.append({"query": query, "corrected_query": corrected_query, "corrections": corrections,
+                            "chunks": chunks})
+        
+        return jsonify({"results": results})
+    except Exception as e:
+        logger.error(f"Error in batch search API: {e}")
+        return jsonify({"error": "An error occurred during batch search"}), 500
+
+@app.route('/api/doses', methods=['GET'])
+def api_doses():
+    """API endpoint to look up doses from the guideline tables by drug, condition or free-text question."""
+    try:
+        drug = request.args.get('drug', '').strip()
+        condition = request.args.get('condition', '').strip()
+        query = request.args.get('q', '').strip()
+        
+        if not drug and not condition and not query:
+            return jsonify({"error": "drug, condition or q is required"}), 400
+        
+        if drug or condition:
+            doses = lookup_doses(drug or None, condition or None)
+        else:
+            doses = [row.to_dict() for row in find_dose_rows(query)[0]]
+        
+        return jsonify({"doses": doses})
+    except Exception as e:
+        logger.error(f"Error in dose lookup API: {e}")
+        return jsonify({"error": "An error occurred during dose lookup"}), 500
+
+@app.route('/api/corpus', methods=['GET'])
+def api_corpus():
+    """API endpoint to list the guideline documents in the corpus."""
+    try:
+        return jsonify({"documents": get_corpus_documents()})
+    except Exception as e:
+        logger.error(f"Error in corpus API: {e}")
+        return jsonify({"error": "An error occurred while listing the corpus"}), 500
+
+@app.route('/api/search/corpus', methods=['POST'])
+def api_search_corpus():
+    """API endpoint to retrieve guideline chunks from every document in the corpus."""
+    try:
+        data = request.json or {}
+        query = data.get('query', '')
+        k = data.get('k', 5)
+        documents = data.get('documents')
+        
+        if not query:
+            return jsonify({"error": "Query is required"}), 400
+        
+        if isinstance(k, bool) or not isinstance(k, int) or not 1 <= k <= SHARD_SEARCH_LIMIT:
+            return jsonify({"error": f"k must be an integer between 1 and {SHARD_SEARCH_LIMIT}"}), 400
+        
+        if documents is not None and (not isinstance(documents, list)
+                                      or not all(isinstance(d, str) for d in documents)):
+            return jsonify({"error": "documents must be a list of document ids"}), 400
+        
+        # Shards are searched in parallel and their top k merged
+        results = search_corpus(query, k=k, doc_ids=documents)
+        
+        return jsonify({"results": results})
+    except Exception as e:
+        logger.error(f"Error in corpus search API: {e}")
+        return jsonify({"error": "An error occurred during corpus search"}), 500
+
+@app.route('/api/admin/reload', methods=['POST'])
+@admin_key_required
+def api_admin_reload():
+    """Admin endpoint to pick up a new revision of the guidelines document without a restart."""
+    try:
+        data = request.get_json(silent=True) or {}
+        force = bool(data.get('force', False))
+        
+        # Rebuilds off to the side; requests keep being served from the current index
+        reloaded = reload_document(force=force)
+        
+        import rag_engine
+        snapshot = rag_engine.active_snapshot
+        return jsonify({
+            "reloaded": reloaded,
+            "version": snapshot.version if snapshot else None,
+            "chunks": len(snapshot.index) if snapshot else 0
+        })
+    except Exception as e:
+        logger.error(f"Error in admin reload API: {e}")
+        return jsonify({"error": "An error occurred while reloading the document"}), 500
+
+@app.route('/api/admin/stats', methods=['GET'])
+@admin_key_required
+def api_admin_stats():
+    """Admin endpoint reporting retrieval statistics of the worker that serves the request."""
+    try:
+        stats = get_retrieval_stats()
+        stats["corpus_shards"] = get_shard_stats()
+        return jsonify(stats)
+    except Exception as e:
+        logger.error(f"Error in admin stats API: {e}")
+        return jsonify({"error": "An error occurred while collecting statistics"}), 500
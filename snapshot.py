@@ -0,0 +1,76 @@
+import os
+import logging
+import hashlib
+import pickle
+from contextlib import contextmanager
+from config import SNAPSHOT_PATH
+try:
+    import fcntl
+except ImportError:  # Not on Windows, where only one process builds the index anyway
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the layout of anything stored in the snapshot changes
+SNAPSHOT_VERSION = 2
+
+def hash_file(path):
+    """Compute the SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_snapshot(doc_hash, path=SNAPSHOT_PATH):
+    """Load the snapshot for a document hash. Returns None if missing, stale or unreadable."""
+    if not doc_hash or not os.path.exists(path):
+        return None
+    
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except Exception as e:
+        logger.warning(f"Could not read snapshot at {path}: {e}")
+        return None
+    
+    if snapshot.get("version") != SNAPSHOT_VERSION or snapshot.get("doc_hash") != doc_hash:
+        logger.info("Snapshot does not match the current document, ignoring it")
+        return None
+    
+    return snapshot
+
+def save_snapshot(doc_hash, path=SNAPSHOT_PATH, **parts):
+    """Merge parts into the snapshot for a document hash and write it atomically."""
+    snapshot = load_snapshot(doc_hash, path) or {"version": SNAPSHOT_VERSION, "doc_hash": doc_hash}
+    snapshot.update(parts)
+    
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        logger.info(f"Saved snapshot ({', '.join(parts)}) to {path}")
+        return True
+    except Exception as e:
+        logger.error(f"Error saving snapshot: {e}")
+        return False
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on path + ".lock" shared by every process, waiting until it is free.
+    
+    Lets one worker write files the others then only read.
+    """
+    if fcntl is None:
+        yield
+        return
+    
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(f"{path}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,69 @@
+import html
+
+from config import SNIPPET_CHARS, SNIPPETS_PER_RESULT
+
+def original_spans(text, offsets, length):
+    """Map match offsets in text.lower() back to (start, end) ranges of text itself.
+
+    Lowercasing only changes lengths for a few characters (such as "İ"), so
+    the offsets are used as they are unless the lowercased text is longer.
+    """
+    if len(text.lower()) == len(text):
+        return [(offset, offset + length) for offset in offsets]
+
+    positions = []
+    for i, char in enumerate(text):
+        positions.extend([i] * len(char.lower()))
+    return [(positions[offset], positions[offset + length - 1] + 1) for offset in offsets]
+
+def snippet_window(text, start, end, width):
+    """Choose a window of about width characters centered on text[start:end], widened to whole words."""
+    pad = max(0, (width - (end - start)) // 2)
+    window_start = max(0, start - pad)
+    window_end = min(len(text), max(end, window_start + width))
+
+    # Don't cut words in half at either edge, nor the match itself
+    if window_start > 0:
+        space = text.find(" ", window_start, start)
+        window_start = space + 1 if space != -1 else window_start
+    if window_end < len(text):
+        space = text.rfind(" ", end, window_end)
+        window_end = space if space != -1 else window_end
+    return window_start, window_end
+
+def highlight(text, window_start, window_end, hits):
+    """Render text[window_start:window_end] as escaped HTML with each hit wrapped in <mark>."""
+    parts = ["&hellip;"] if window_start > 0 else []
+    position = window_start
+    for start, end in hits:
+        parts.append(html.escape(text[position:start]))
+        parts.append(f"<mark>{html.escape(text[start:end])}</mark>")
+        position = end
+    parts.append(html.escape(text[position:window_end]))
+    if window_end < len(text):
+        parts.append("&hellip;")
+    return "".join(parts)
+
+def make_snippets(text, spans, width=SNIPPET_CHARS, max_snippets=SNIPPETS_PER_RESULT):
+    """Build highlighted snippet windows around the first hits of a section.
+
+    spans are (start, end) hit ranges in document order. Hits that fall in a
+    window already opened share it. Each snippet has its character range in
+    the section text, the plain text and the highlighted HTML.
+    """
+    windows = []
+    for start, end in spans:
+        if windows and end <= windows[-1][1]:
+            windows[-1][2].append((start, end))
+            continue
+        if len(windows) == max_snippets:
+            break
+        window_start, window_end = snippet_window(text, start, end, width)
+        windows.append((window_start, window_end, [(start, end)]))
+
+    return [{
+        "start": window_start,
+        "end": window_end,
+        "text": text[window_start:window_end],
+        "html": highlight(text, window_start, window_end, hits),
+    } for window_start, window_end, hits in windows]
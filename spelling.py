@@ -0,0 +1,119 @@
+import sys
+
+MAX_EDIT_DISTANCE = 2  # Largest correction considered for long words
+SHORT_WORD_LENGTH = 6  # Words shorter than this are corrected by at most one edit
+MIN_WORD_LENGTH = 4  # Shorter words are too ambiguous to correct
+PREFIX_LENGTH = 7  # Deletions are only generated within this prefix, which bounds the index size
+
+def deletions(word, max_distance, prefix_length=PREFIX_LENGTH):
+    """Return every string obtained by deleting up to max_distance characters from the word's prefix."""
+    prefix = word[:prefix_length]
+    found = {prefix}
+    frontier = [prefix]
+    for _ in range(max_distance):
+        next_frontier = []
+        for item in frontier:
+            for i in range(len(item)):
+                deleted = item[:i] + item[i + 1:]
+                if deleted not in found:
+                    found.add(deleted)
+                    next_frontier.append(deleted)
+        frontier = next_frontier
+    return found
+
+def edit_distance(a, b, max_distance):
+    """Damerau-Levenshtein (optimal string alignment) distance, or max_distance + 1 once it is exceeded."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    previous_row = None
+    row = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before_previous, previous_row = previous_row, row
+        row = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            row[j] = min(previous_row[j] + 1, row[j - 1] + 1, previous_row[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], before_previous[j - 2] + 1)
+        if min(row) > max_distance:
+            return max_distance + 1
+    return row[-1]
+
+def is_correctable(token):
+    """True for tokens long and alphabetic enough to be spelling-corrected."""
+    return len(token) >= MIN_WORD_LENGTH and token.isalpha()
+
+class SpellIndex:
+    """SymSpell-style typo corrector over a fixed vocabulary.
+
+    The deletions of every vocabulary term are precomputed, so correcting a
+    word only generates the word's own deletions and verifies the handful of
+    terms they lead to. A word is only corrected when exactly one term is
+    closest to it, so a drug name missing from the guide is left alone rather
+    than swapped for whichever similar term is most common.
+    """
+    __slots__ = ("frequencies", "deletes")
+
+    def __init__(self, frequencies):
+        self.frequencies = frequencies
+        self.deletes = {}
+        for term in frequencies:
+            for deleted in deletions(term, MAX_EDIT_DISTANCE):
+                self.deletes.setdefault(deleted, []).append(term)
+
+    @classmethod
+    def from_index(cls, index):
+        """Build the corrector from the alphabetic terms of a FlatIndex, weighted by document frequency."""
+        frequencies = {}
+        for term_id, term in enumerate(index.terms):
+            if len(term) >= MIN_WORD_LENGTH - MAX_EDIT_DISTANCE and term.isalpha():
+                frequencies[term] = index.doc_freq(term_id)
+        return cls(frequencies)
+
+    def lookup(self, word):
+        """Return the closest vocabulary term for a lowercase word, or None if none is close or several tie."""
+        if word in self.frequencies:
+            return word
+
+        max_distance = 1 if len(word) < SHORT_WORD_LENGTH else MAX_EDIT_DISTANCE
+        best = []
+        best_distance = max_distance + 1
+        seen = set()
+        for deleted in deletions(word, max_distance):
+            for term in self.deletes.get(deleted, ()):
+                if term in seen:
+                    continue
+                seen.add(term)
+                distance = edit_distance(word, term, max_distance)
+                if distance > max_distance:
+                    continue
+                if distance < best_distance:
+                    best, best_distance = [term], distance
+                elif distance == best_distance:
+                    best.append(term)
+        return best[0] if len(best) == 1 else None
+
+    def correct_tokens(self, tokens, corrections=None, keep=None):
+        """Replace out-of-vocabulary alphabetic tokens with their closest vocabulary term.
+
+        If corrections is a dict, each rewrite is recorded in it as token -> term.
+        Tokens for which keep(token) is true are never rewritten.
+        """
+        corrected = []
+        for token in tokens:
+            if is_correctable(token) and token not in self.frequencies and not (keep and keep(token)):
+                term = self.lookup(token)
+                if term:
+                    if corrections is not None:
+                        corrections[token] = term
+                    token = term
+            corrected.append(token)
+        return corrected
+
+    def stats(self):
+        """Get the vocabulary size, number of deletion keys and approximate memory of the index."""
+        nbytes = sys.getsizeof(self.frequencies) + sys.getsizeof(self.deletes)
+        nbytes += sum(sys.getsizeof(term) for term in self.frequencies)
+        nbytes += sum(sys.getsizeof(deleted) + sys.getsizeof(terms) for deleted, terms in self.deletes.items())
+        return {"terms": len(self.frequencies), "delete_keys": len(self.deletes), "approx_bytes": nbytes}
@@ -0,0 +1,127 @@
+import numpy as np
+
+SEPARATOR = "\x00"  # Joins the texts; never part of a pattern, so matches stay inside one text
+
+def build_suffix_array(codes):
+    """Sort the suffixes of an integer sequence by prefix doubling.
+
+    Suffixes start out ranked by their first few symbols packed into one
+    int64, then each round sorts by (rank of the first k symbols, rank of the
+    next k) packed into a single key, doubling k until every suffix has a
+    distinct rank. Building takes O(n log^2 n) in numpy.
+    """
+    n = len(codes)
+    if n == 0:
+        return np.zeros(0, dtype=np.int32)
+
+    # Dense symbol ids, packed as many per key as fit in 62 bits
+    alphabet, symbols = np.unique(codes, return_inverse=True)
+    bits = max(1, int(len(alphabet)).bit_length())
+    # Never pack more symbols than the sequence has, or the shifted slices below would be negative
+    width = max(1, min(62 // bits, n))
+    key = np.zeros(n, dtype=np.int64)
+    for offset in range(width):
+        shifted = np.zeros(n, dtype=np.int64)
+        shifted[:n - offset] = symbols[offset:] + 1
+        key = (key << bits) | shifted
+
+    k = width
+    while True:
+        order = np.argsort(key, kind="stable")
+        sorted_key = key[order]
+        rank = np.empty(n, dtype=np.int64)
+        rank[order] = np.concatenate(([0], np.cumsum(sorted_key[1:] != sorted_key[:-1])))
+        if rank[order[-1]] == n - 1 or k >= n:
+            return order.astype(np.int32)
+
+        # Rank of the next k symbols, 0 past the end of the sequence
+        second = np.zeros(n, dtype=np.int64)
+        second[:n - k] = rank[k:] + 1
+        key = rank * (n + 1) + second
+        k *= 2
+
+def self_overlaps(pattern):
+    """True if two occurrences of pattern can overlap, i.e. a proper prefix is also a suffix."""
+    return any(pattern[:i] == pattern[-i:] for i in range(1, len(pattern)))
+
+class SubstringIndex:
+    """Suffix array over a list of texts for exact substring search.
+
+    The texts are joined into one string and its suffixes sorted once.
+    Finding every occurrence of a pattern is two binary searches over the
+    suffix array, O(m log n) for a pattern of length m, however many texts
+    there are.
+    """
+    __slots__ = ("text", "starts", "suffixes")
+
+    def __init__(self, texts):
+        self.text = SEPARATOR.join(texts)
+        starts = [0]
+        for text in texts:
+            starts.append(starts[-1] + len(text) + 1)
+        self.starts = np.array(starts, dtype=np.int64)  # Text i is self.text[starts[i]:starts[i + 1] - 1]
+        codes = np.frombuffer(self.text.encode("utf-32-le"), dtype=np.uint32)
+        self.suffixes = build_suffix_array(codes)
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def _bound(self, pattern, upper):
+        """First suffix-array slot whose suffix prefix is >= pattern (> pattern when upper)."""
+        text = self.text
+        suffixes = self.suffixes
+        m = len(pattern)
+        lo, hi = 0, len(suffixes)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = suffixes[mid]
+            prefix = text[start:start + m]
+            if prefix < pattern or (upper and prefix == pattern):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, pattern):
+        """Return the sorted start offsets in the joined text of every occurrence of pattern."""
+        if not pattern or SEPARATOR in pattern:
+            return np.zeros(0, dtype=np.int64)
+        lo = self._bound(pattern, False)
+        hi = self._bound(pattern, True)
+        return np.sort(self.suffixes[lo:hi].astype(np.int64))
+
+    def occurrences(self, pattern):
+        """Map each text id containing pattern to the sorted offsets of its occurrences within that text."""
+        positions = self.find(pattern)
+        if len(positions) == 0:
+            return {}
+        text_ids = np.searchsorted(self.starts, positions, side="right") - 1
+        boundaries = np.flatnonzero(np.diff(text_ids)) + 1
+        return {int(ids[0]): chunk - self.starts[ids[0]]
+                for ids, chunk in zip(np.split(text_ids, boundaries), np.split(positions, boundaries))}
+
+    def matches(self, pattern):
+        """Map each text id containing pattern to the offsets of its non-overlapping occurrences.
+
+        Occurrences are taken greedily from the left, the ones str.count counts.
+        """
+        found = self.occurrences(pattern)
+        if not self_overlaps(pattern):
+            return found
+
+        m = len(pattern)
+        for text_id, offsets in found.items():
+            kept = []
+            next_free = 0
+            for offset in offsets.tolist():
+                if offset >= next_free:
+                    kept.append(offset)
+                    next_free = offset + m
+            found[text_id] = np.array(kept, dtype=np.int64)
+        return found
+
+    def counts(self, pattern):
+        """Map each text id containing pattern to its number of non-overlapping occurrences, like str.count."""
+        if not pattern:
+            return {text_id: int(self.starts[text_id + 1] - self.starts[text_id]) for text_id in range(len(self))}
+        return {text_id: len(offsets) for text_id, offsets in self.matches(pattern).items()}
@@ -0,0 +1,121 @@
+import threading
+
+from aho_corasick import AhoCorasick
+
+# Clinical abbreviations and the terms the guide spells out
+ABBREVIATIONS = {
+    "uti": "urinary tract infection",
+    "dka": "diabetic ketoacidosis",
+    "pud": "peptic ulcer disease",
+    "htn": "hypertension",
+    "gerd": "gastro-oesophageal reflux disease",
+    "gord": "gastro-oesophageal reflux disease",
+    "tb": "tuberculosis",
+    "ptb": "pulmonary tuberculosis",
+    "dm": "diabetes mellitus",
+    "t1dm": "type 1 diabetes mellitus",
+    "t2dm": "type 2 diabetes mellitus",
+    "gdm": "diabetes in pregnancy",
+    "sti": "sexually transmitted infections",
+    "std": "sexually transmitted infections",
+    "hiv": "human immunodeficiency virus",
+    "urti": "upper respiratory tract infection",
+    "lrti": "lower respiratory tract infection",
+    "aom": "acute otitis media",
+    "csom": "chronic otitis media",
+    "anug": "acute necrotizing ulcerative gingivitis",
+    "oa": "osteoarthritis",
+    "ra": "rheumatoid arthritis",
+    "jia": "juvenile idiopathic arthritis",
+    "lbp": "back pain",
+    "aub": "abnormal vaginal bleeding",
+    "pid": "pelvic inflammatory disease",
+    "ors": "oral rehydration salts",
+    "nsaid": "non-steroidal anti-inflammatory drug",
+    "nsaids": "non-steroidal anti-inflammatory drugs",
+    "ppi": "proton pump inhibitor",
+    "bp": "blood pressure",
+    "fbc": "full blood count",
+    "rdt": "rapid diagnostic test",
+    "im": "intramuscular",
+    "iv": "intravenous",
+}
+
+# American and British spellings, matched in both directions
+SPELLING_VARIANTS = {
+    "anemia": "anaemia",
+    "diarrhea": "diarrhoea",
+    "dysmenorrhea": "dysmenorrhoea",
+    "hemorrhoids": "haemorrhoids",
+    "hemorrhage": "haemorrhage",
+    "hemoglobin": "haemoglobin",
+    "hypoglycemia": "hypoglycaemia",
+    "hyperglycemia": "hyperglycaemia",
+    "dyslipidemia": "dyslipidaemia",
+    "esophageal": "oesophageal",
+    "gastroesophageal": "gastro-oesophageal",
+    "edema": "oedema",
+    "pediatric": "paediatric",
+    "fetal": "foetal",
+    "estrogen": "oestrogen",
+    "goiter": "goitre",
+    "leukemia": "leukaemia",
+    "septicemia": "septicaemia",
+    "anesthesia": "anaesthesia",
+    "orthopedic": "orthopaedic",
+    "tumor": "tumour",
+    "color": "colour",
+    "chickenpox": "chicken pox",
+}
+
+class ExpansionMap:
+    """Abbreviations, their spelled-out forms and spelling variants compiled into one automaton.
+
+    expand() finds every whole-word key in a lowercased query in one pass and
+    returns the terms to add, counting how many queries gained any.
+    """
+    __slots__ = ("automaton", "words", "lookups", "hits", "_lock")
+
+    def __init__(self, abbreviations, variants):
+        patterns = []
+        for short, full in abbreviations.items():
+            patterns.append((short, full))
+            patterns.append((full, short))
+        for american, british in variants.items():
+            patterns.append((american, british))
+            patterns.append((british, american))
+        self.automaton = AhoCorasick(patterns)
+        self.words = frozenset(key for key, _ in patterns if " " not in key)  # Single-word keys, see knows
+        self.lookups = 0
+        self.hits = 0
+        self._lock = threading.Lock()
+
+    def expand(self, query_lower):
+        """Return the expansion terms for a lowercased query that it does not already contain."""
+        expansions = []
+        padded = f" {query_lower} "
+        for _, _, term in self.automaton.iter_matches(query_lower, whole_words=True):
+            if term not in expansions and f" {term} " not in padded:
+                expansions.append(term)
+
+        with self._lock:
+            self.lookups += 1
+            if expansions:
+                self.hits += 1
+        return expansions
+
+    def knows(self, word):
+        """True if a lowercase word is an abbreviation or spelling the map expands, such as "gerd"."""
+        return word in self.words
+
+    def stats(self):
+        """Get how many queries were looked up and how many gained an expansion."""
+        with self._lock:
+            return {
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            }
+
+# Compiled once at import and shared by every request
+expansion_map = ExpansionMap(ABBREVIATIONS, SPELLING_VARIANTS)
@@ -0,0 +1,37 @@
+from dosage_index import DosageIndex
+
+TABLES = [
+    {
+        "chapter": "Gastrointestinal Conditions",
+        "section": "Peptic Ulcer Disease",
+        "rows": [
+            ["Medicine", "Adult dose", "Frequency", "Duration"],
+            ["Amoxicillin", "1 g", "12 hourly", "14 days"],
+            ["Omeprazole", "20 mg", "12 hourly", "14 days"],
+        ],
+    },
+    {
+        "chapter": "Infections",
+        "section": "Malaria",
+        "rows": [
+            ["Medicine", "Adult dose", "Child dose"],
+            ["Artemether-lumefantrine", "4 tablets", "1 tablet per 15 kg"],
+        ],
+    },
+]
+
+def covered(index, text, topics=()):
+    return index.covers_query(text, index.rows_for_query(text), topics)
+
+def test_rows_for_another_condition_do_not_answer_the_question():
+    index = DosageIndex.from_tables(TABLES)
+    # No table covers pneumonia, so rows_for_query falls back to the peptic ulcer rows
+    assert [row.section for row in index.rows_for_query("dose of amoxicillin for pneumonia")] == ["Peptic Ulcer Disease"]
+    assert not covered(index, "dose of amoxicillin for pneumonia", ["Pneumonia"])
+    assert covered(index, "dose of amoxicillin for peptic ulcer disease", ["Peptic Ulcer Disease"])
+    assert covered(index, "dose of amoxicillin")
+
+def test_child_questions_need_a_paediatric_dose():
+    index = DosageIndex.from_tables(TABLES)
+    assert not covered(index, "dose of amoxicillin for a child")
+    assert covered(index, "artemether-lumefantrine dose for children with malaria", ["Malaria"])
@@ -0,0 +1,37 @@
+from spelling import SpellIndex
+
+def test_unique_closest_term_is_corrected():
+    speller = SpellIndex({"malaria": 5, "treatment": 9, "tablets": 3})
+    corrections = {}
+    assert speller.correct_tokens(["treatmnt", "of", "malria"], corrections) == ["treatment", "of", "malaria"]
+    assert corrections == {"treatmnt": "treatment", "malria": "malaria"}
+
+def test_ties_at_the_minimum_distance_are_left_alone():
+    # "cough" and "couch" are both one edit from "coush", however often each occurs
+    speller = SpellIndex({"cough": 50, "couch": 1})
+    assert speller.lookup("coush") is None
+    corrections = {}
+    assert speller.correct_tokens(["coush"], corrections) == ["coush"]
+    assert corrections == {}
+
+def test_unknown_words_far_from_the_vocabulary_are_kept():
+    speller = SpellIndex({"amoxicillin": 4})
+    assert speller.correct_tokens(["paracetamol"]) == ["paracetamol"]
+
+def test_stats_report_the_index_size():
+    stats = SpellIndex({"fever": 2, "pain": 1}).stats()
+    assert stats["terms"] == 2
+    assert stats["delete_keys"] > 2
+    assert stats["approx_bytes"] > 0
+
+def test_candidates_past_the_edit_limit_are_rejected():
+    # Long words allow two edits, words shorter than six letters only one
+    assert SpellIndex({"treatment": 3}).lookup("treatxxxt") is None
+    assert SpellIndex({"treatment": 3}).lookup("treatxxnt") == "treatment"
+    assert SpellIndex({"loose": 1}).lookup("dose") is None
+    assert SpellIndex({"dose": 1}).lookup("dosw") == "dose"
+
+def test_kept_tokens_are_not_rewritten():
+    speller = SpellIndex({"germ": 2})
+    assert speller.correct_tokens(["gerd"], keep=lambda token: token == "gerd") == ["gerd"]
+    assert speller.correct_tokens(["gerd"]) == ["germ"]
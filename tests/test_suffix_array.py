@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from suffix_array import SubstringIndex, build_suffix_array
+
+def naive_suffix_array(text):
+    return sorted(range(len(text)), key=lambda i: text[i:])
+
+@pytest.mark.parametrize("texts", [[], [""], ["a"], ["Fever"], ["hello world"], ["ab", ""], ["aaaa", "aa"]])
+def test_short_and_empty_inputs(texts):
+    index = SubstringIndex(texts)
+    assert list(index.suffixes) == naive_suffix_array(index.text)
+    for pattern in ("a", "e", "l", "o w", "aa", "zz"):
+        assert index.counts(pattern) == {i: text.count(pattern) for i, text in enumerate(texts) if pattern in text}
+
+def test_empty_codes():
+    assert len(build_suffix_array(np.zeros(0, dtype=np.uint32))) == 0
+
+def test_matches_str_count_on_longer_text():
+    rng = np.random.default_rng(0)
+    texts = ["".join(rng.choice(list("ab c"), size=size)) for size in (0, 1, 7, 50, 300)]
+    index = SubstringIndex(texts)
+    assert list(index.suffixes) == naive_suffix_array(index.text)
+    for pattern in ("a", "ab", "aba", "b a", "cc", "abab"):
+        assert index.counts(pattern) == {i: text.count(pattern) for i, text in enumerate(texts) if pattern in text}
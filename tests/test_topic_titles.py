@@ -0,0 +1,30 @@
+import pytest
+
+from rag_engine import title_covers_topic
+
+@pytest.mark.parametrize("title, topic", [
+    ("Malaria", "Malaria"),
+    ("Urinary Tract Infection", "Urinary Tract Infections"),
+    ("Large Chronic Ulcers", "large chronic ulcer"),
+])
+def test_titles_naming_the_whole_topic_are_accepted(title, topic):
+    assert title_covers_topic(title, topic)
+
+@pytest.mark.parametrize("title, topic", [
+    ("Infections", "Herpes Zoster Infections"),
+    ("Infections", "Sexually Transmitted Infections in Adults"),
+    ("Peptic Ulcer Disease", "Buruli ulcer"),
+    ("Gastrointestinal Disorders", "Gastro-oesophageal Reflux Disease"),
+])
+def test_titles_sharing_only_some_words_are_rejected(title, topic):
+    assert not title_covers_topic(title, topic)
+
+def test_title_matches_keep_the_original_query_bonuses():
+    from rag_engine import TitleMatcher
+    matcher = TitleMatcher({"Blood Disorders": {"content": [], "sections": {"Anaemia": []}}})
+    (title_id, score), *_ = matcher.match("Anaemia", ["anemia"])
+    assert matcher.titles[title_id] == ("Blood Disorders", "Anaemia")
+    # Full title, its word, the whole query and the capitalised disease name
+    assert score == 26
+    # Expansions alone still find the title
+    assert matcher.match("what causes it", ["anaemia"])[0][0] == title_id
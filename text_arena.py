@@ -0,0 +1,107 @@
+from array import array
+
+class TextArena:
+    """Read-only sequence of document lines stored as one string plus an offsets array.
+
+    Lines are joined by newlines into a single str and only sliced out when
+    indexed, so a document costs one string object instead of one per line.
+    """
+    __slots__ = ("text", "offsets")
+
+    def __init__(self, lines=()):
+        parts = []
+        offsets = array('q', [0])
+        for line in lines:
+            parts.append(line)
+            offsets.append(offsets[-1] + len(line) + 1)
+        self.text = "\n".join(parts)
+        self.offsets = offsets  # Line i is text[offsets[i]:offsets[i + 1] - 1]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("line index out of range")
+        return self.text[self.offsets[i]:self.offsets[i + 1] - 1]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __eq__(self, other):
+        if isinstance(other, TextArena):
+            return self.text == other.text and self.offsets == other.offsets
+        return list(self) == other
+
+    __hash__ = None
+
+    def view(self, line_numbers):
+        """Return a LineView over the given line numbers of this arena."""
+        return LineView(self, line_numbers)
+
+    def span(self, start, end):
+        """Return lines start..end-1 joined by newlines, as one slice of the arena."""
+        if start >= end:
+            return ""
+        return self.text[self.offsets[start]:self.offsets[end] - 1]
+
+class LineView:
+    """Read-only sequence of some lines of a TextArena, such as the body of one section.
+
+    The lines are kept as (start, end) runs of line numbers, usually a single
+    run, and materialized as str slices of the arena when read.
+    """
+    __slots__ = ("arena", "runs", "length")
+
+    def __init__(self, arena, line_numbers=()):
+        runs = array('q')
+        for line_no in line_numbers:
+            if runs and runs[-1] == line_no:
+                runs[-1] = line_no + 1
+            else:
+                runs.extend((line_no, line_no + 1))
+        self.arena = arena
+        self.runs = runs  # Flattened start, end pairs
+        self.length = sum(runs[i + 1] - runs[i] for i in range(0, len(runs), 2))
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError("line index out of range")
+        for run in range(0, len(self.runs), 2):
+            start, end = self.runs[run], self.runs[run + 1]
+            if i < end - start:
+                return self.arena[start + i]
+            i -= end - start
+
+    def __iter__(self):
+        for run in range(0, len(self.runs), 2):
+            for line_no in range(self.runs[run], self.runs[run + 1]):
+                yield self.arena[line_no]
+
+    def __eq__(self, other):
+        if isinstance(other, LineView) and other.arena is self.arena:
+            return self.runs == other.runs
+        if isinstance(other, (LineView, list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"LineView({list(self)!r})"
+
+    def text(self):
+        """Return the lines joined by newlines, slicing the arena once per run."""
+        return "\n".join(self.arena.span(self.runs[run], self.runs[run + 1]) for run in range(0, len(self.runs), 2))
@@ -0,0 +1,211 @@
+import os
+import json
+import math
+import logging
+import hashlib
+import zlib
+import re
+from collections import Counter
+import numpy as np
+from config import VECTOR_DB_PATH, EMBEDDING_DIM, EMBEDDING_DTYPE
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_FILE = "embeddings.npy"
+IDF_FILE = "idf.npy"
+METADATA_FILE = "metadata.json"
+ENCODER_NAME = "hashed-ngram-v2"
+
+# Global variables - arrays are read-only memory maps shared through the page cache
+vector_index = {"embeddings": None, "idf": None, "metadata": {}}
+
+def fingerprint_chunks(chunks):
+    """Compute a stable fingerprint of the chunk list so stale indexes can be detected."""
+    digest = hashlib.sha1()
+    for chunk in chunks:
+        digest.update(chunk.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def _hash_feature(feature, dim):
+    """Map a feature string to a (bucket, sign) pair with a process-independent hash."""
+    h = zlib.crc32(feature.encode("utf-8"))
+    return h % dim, 1.0 if (h >> 31) & 1 else -1.0
+
+def extract_features(text):
+    """Extract word unigrams, word bigrams and character trigrams from text."""
+    words = re.findall(r'\b\w+\b', text.lower())
+    features = Counter(words)
+    features.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    for word in words:
+        padded = f"#{word}#"
+        features.update(f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+    return features
+
+def encode_raw(texts, dim=EMBEDDING_DIM):
+    """Encode texts into unweighted, unnormalized hashed n-gram vectors."""
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    
+    for row, text in enumerate(texts):
+        for feature, count in extract_features(text).items():
+            bucket, sign = _hash_feature(feature, dim)
+            matrix[row, bucket] += sign * (1.0 + math.log(count))
+    
+    return matrix
+
+def weight_and_normalize(matrix, idf=None):
+    """IDF-weight raw feature rows in place and scale them to unit length."""
+    if idf is not None:
+        matrix *= idf
+    
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+def encode_texts(texts, idf=None, dim=EMBEDDING_DIM):
+    """Encode texts into L2-normalized hashed n-gram vectors, optionally IDF-weighted."""
+    return weight_and_normalize(encode_raw(texts, dim), idf)
+
+def compute_bucket_idf(raw):
+    """Compute a smoothed IDF weight for every hash bucket from raw corpus feature rows."""
+    doc_freq = np.count_nonzero(raw, axis=0).astype(np.float32)
+    return np.log((1 + len(raw)) / (1 + doc_freq)).astype(np.float32) + 1.0
+
+def reuse_raw_features(chunks, previous):
+    """Encode raw feature rows, recovering unchanged chunks from a previous index.
+    
+    previous is (texts, vectors) of the index being replaced. A stored embedding
+    divided by its IDF is its raw row up to scale, and the scale cancels out on
+    normalization, so only chunks whose text changed are re-encoded.
+    """
+    old_texts, old_vectors = previous
+    old_rows = {text: row for row, text in enumerate(old_texts)}
+    old_embeddings = old_vectors["embeddings"]
+    old_idf = np.asarray(old_vectors["idf"], dtype=np.float32)
+    
+    raw = np.zeros((len(chunks), EMBEDDING_DIM), dtype=np.float32)
+    changed = [row for row, text in enumerate(chunks) if text not in old_rows]
+    for row, text in enumerate(chunks):
+        old_row = old_rows.get(text)
+        if old_row is not None:
+            raw[row] = old_embeddings[old_row].astype(np.float32) / old_idf
+    if changed:
+        raw[changed] = encode_raw([chunks[row] for row in changed])
+    
+    logger.info(f"Re-encoded {len(changed)} of {len(chunks)} chunk embeddings")
+    return raw
+
+def build_vector_index(chunks, path=VECTOR_DB_PATH, previous=None):
+    """Embed all chunks offline and write the embedding matrix and metadata sidecar to path.
+    
+    previous is an optional (texts, vectors) pair for the index being replaced,
+    whose embeddings are reused for chunks that did not change.
+    """
+    os.makedirs(path, exist_ok=True)
+    
+    chunks = list(chunks)
+    raw = reuse_raw_features(chunks, previous) if previous else encode_raw(chunks)
+    idf = compute_bucket_idf(raw)
+    embeddings = weight_and_normalize(raw, idf).astype(EMBEDDING_DTYPE)
+    
+    # Write to temporary files first and rename, so concurrent workers never see partial files
+    pid = os.getpid()
+    embeddings_tmp = os.path.join(path, f"{EMBEDDINGS_FILE}.{pid}.tmp")
+    idf_tmp = os.path.join(path, f"{IDF_FILE}.{pid}.tmp")
+    metadata_tmp = os.path.join(path, f"{METADATA_FILE}.{pid}.tmp")
+    
+    with open(embeddings_tmp, "wb") as f:
+        np.save(f, embeddings)
+    with open(idf_tmp, "wb") as f:
+        np.save(f, idf)
+    
+    metadata = {
+        "encoder": ENCODER_NAME,
+        "dim": EMBEDDING_DIM,
+        "dtype": EMBEDDING_DTYPE,
+        "count": len(chunks),
+        "fingerprint": fingerprint_chunks(chunks),
+    }
+    with open(metadata_tmp, "w") as f:
+        json.dump(metadata, f)
+    
+    os.replace(embeddings_tmp, os.path.join(path, EMBEDDINGS_FILE))
+    os.replace(idf_tmp, os.path.join(path, IDF_FILE))
+    os.replace(metadata_tmp, os.path.join(path, METADATA_FILE))
+    
+    logger.info(f"Wrote {len(chunks)} chunk embeddings ({EMBEDDING_DIM}d, {EMBEDDING_DTYPE}) to {path}")
+    return metadata
+
+def load_vector_index(path=VECTOR_DB_PATH, fingerprint=None):
+    """Memory-map the embedding matrix read-only. Returns the index, or None if missing or stale."""
+    global vector_index
+    
+    metadata_path = os.path.join(path, METADATA_FILE)
+    if not os.path.exists(metadata_path):
+        return None
+    
+    try:
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+        
+        if metadata.get("encoder") != ENCODER_NAME or metadata.get("dim") != EMBEDDING_DIM:
+            logger.info("Vector index was built with a different encoder, rebuilding")
+            return None
+        if fingerprint and metadata.get("fingerprint") != fingerprint:
+            logger.info("Vector index is stale for the current document chunks, rebuilding")
+            return None
+        
+        embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode="r")
+        idf = np.load(os.path.join(path, IDF_FILE), mmap_mode="r")
+        
+        if embeddings.shape != (metadata["count"], EMBEDDING_DIM):
+            logger.warning(f"Vector index shape {embeddings.shape} does not match its metadata")
+            return None
+        
+        vector_index = {"embeddings": embeddings, "idf": idf, "metadata": metadata}
+        logger.info(f"Memory-mapped vector index with {metadata['count']} embeddings from {path}")
+        return vector_index
+    except Exception as e:
+        logger.error(f"Error loading vector index: {e}")
+        return None
+
+def initialize_vector_index(chunks, path=VECTOR_DB_PATH, fingerprint=None, previous=None):
+    """Load the persisted vector index for these chunks, building it first if needed.
+    
+    Returns the loaded index, or None if it could not be loaded or built.
+    """
+    fingerprint = fingerprint or fingerprint_chunks(chunks)
+    vectors = load_vector_index(path, fingerprint)
+    if vectors:
+        return vectors
+    
+    try:
+        build_vector_index(chunks, path, previous)
+    except Exception as e:
+        logger.error(f"Error building vector index: {e}")
+        return None
+    
+    return load_vector_index(path, fingerprint)
+
+def search_dense(query, k=5, vectors=None):
+    """Return (chunk_id, cosine similarity) pairs for the k nearest chunks to the query.
+    
+    vectors is a loaded vector index, by default the one loaded last.
+    """
+    vectors = vectors or vector_index
+    embeddings = vectors["embeddings"]
+    if embeddings is None or len(embeddings) == 0:
+        return []
+    
+    query_vector = encode_texts([query], idf=vectors["idf"])[0]
+    if not query_vector.any():
+        return []
+    
+    # Single matrix-vector product, then partial selection of the top k
+    similarities = embeddings @ query_vector.astype(embeddings.dtype)
+    k = min(k, len(similarities))
+    top = np.argpartition(-similarities, k - 1)[:k]
+    top = top[np.argsort(-similarities[top])]
+    
+    return [(int(chunk_id), float(similarities[chunk_id])) for chunk_id in top]